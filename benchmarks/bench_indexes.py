@@ -0,0 +1,154 @@
+"""
+Show the query plans and timings of the hot ``TravelLog`` and ``TravelEntity``
+lookups with and without the composite indexes.
+
+Runs against the demo database, scaled up inside a transaction that is rolled
+back afterwards, so the database is left as it was:
+
+    PYTHONPATH=src:demo DJANGO_SETTINGS_MODULE=demo_proj.settings \\
+        python benchmarks/bench_indexes.py [--scale N] [--logs N] [--repeat N]
+"""
+
+import argparse
+import datetime
+import random
+import timeit
+
+import django
+
+
+class Rollback(Exception):
+    pass
+
+
+def scale_entities(TravelEntity, scale):
+    """
+    Add ``scale - 1`` copies of every entity, with codes made unique per copy
+    so that lookups by code stay as selective as on the original data.
+    """
+    fields = [
+        f.attname for f in TravelEntity._meta.concrete_fields if not f.primary_key
+    ]
+    rows = list(TravelEntity.objects.order_by().values(*fields))
+    for copy in range(1, scale):
+        TravelEntity.objects.bulk_create(
+            [
+                TravelEntity(**dict(row, code=f"{row['code']}{copy}"))
+                for row in rows
+            ],
+            batch_size=2000,
+        )
+
+
+def add_logs(User, TravelLog, entity_ids, users, logs, rng):
+    start = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(users):
+        user = User.objects.create(username=f"bench-indexes-{i}")
+        TravelLog.objects.bulk_create(
+            [
+                TravelLog(
+                    user=user,
+                    entity_id=rng.choice(entity_ids),
+                    arrival=start
+                    + datetime.timedelta(minutes=rng.randrange(13_000_000)),
+                )
+                for _ in range(logs)
+            ],
+            batch_size=2000,
+        )
+
+    return user
+
+
+def lookups(TravelEntity, TravelLog, user, entity, state):
+    from django.db.models import Count
+
+    return {
+        "entity logs": lambda: TravelLog.objects.filter(user=user, entity=entity),
+        "history": lambda: TravelLog.objects.filter(user=user)
+        .order_by("-arrival")
+        .values("id", "arrival", "entity__id", "rating"),
+        "checklist": lambda: TravelLog.objects.filter(user=user)
+        .order_by()
+        .values_list("entity")
+        .annotate(count=Count("entity")),
+        "find": lambda: TravelEntity.objects.find("co", entity.code, None),
+        "find aux": lambda: TravelEntity.objects.find(
+            "st", state.country.code, state.code
+        ),
+    }
+
+
+def explain(qs, tag):
+    from django.db import connection
+
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        # The tag keeps sqlite3 from reusing a plan prepared before DROP INDEX
+        cursor.execute(
+            f"{connection.ops.explain_query_prefix()} {sql} /* {tag} */", params
+        )
+        return [" ".join(str(col) for col in row) for row in cursor.fetchall()]
+
+
+def report(title, queries, repeat):
+    print(f"== {title}")
+    for name, make in queries.items():
+        best = min(timeit.repeat(lambda: list(make()), number=1, repeat=repeat))
+        print(f"{name:<14}{best * 1000:>10.2f} ms")
+        for line in explain(make(), title):
+            print(f"{'':<16}{line}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logs", type=int, default=5000, help="logs per user")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    django.setup()
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from travel.models import TravelEntity, TravelLog
+
+    composite = [
+        index
+        for model in (TravelEntity, TravelLog)
+        for index in model._meta.indexes
+        if index.fields != ["type", "name", "id"]
+    ]
+
+    rng = random.Random(0)
+    try:
+        with transaction.atomic():
+            scale_entities(TravelEntity, args.scale)
+            entity_ids = list(TravelEntity.objects.values_list("id", flat=True))
+            user = add_logs(User, TravelLog, entity_ids, args.users, args.logs, rng)
+            print(
+                f"{TravelEntity.objects.count()} entities, "
+                f"{TravelLog.objects.count()} logs\n"
+            )
+
+            entity = TravelLog.objects.filter(user=user, entity__type__abbr="co")
+            entity = entity.select_related("entity").first().entity
+            state = TravelEntity.objects.filter(type__abbr="st").first()
+            queries = lookups(TravelEntity, TravelLog, user, entity, state)
+
+            connection.cursor().execute("ANALYZE")
+            report("with composite indexes", queries, args.repeat)
+            with connection.cursor() as cursor:
+                # The SQLite schema editor refuses to run inside a transaction
+                for index in composite:
+                    name = connection.ops.quote_name(index.name)
+                    cursor.execute(f"DROP INDEX {name}")
+            report("single-column indexes only", queries, args.repeat)
+            raise Rollback
+    except Rollback:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare the default and compact JSON formats of ``travel.utils`` on a
+synthetic log history.
+
+    PYTHONPATH=src python benchmarks/bench_json.py [--logs N] [--repeat N]
+"""
+
+import argparse
+import datetime
+import random
+import timeit
+from decimal import Decimal
+
+from travel import utils
+
+
+def make_history(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    return {
+        "logs": [
+            {
+                "id": i,
+                "arrival": start
+                + datetime.timedelta(minutes=rng.randrange(13_000_000)),
+                "entity__id": rng.randrange(1, 20_000),
+                "rating": rng.randrange(1, 6),
+                "value": Decimal(rng.randrange(10**6)) / 1000,
+            }
+            for i in range(count)
+        ]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = make_history(args.logs)
+    formats = {
+        "default": ({"indent": None}, {}),
+        "compact": ({"compact": True}, {"compact": True}),
+    }
+
+    print(f"{args.logs} logs, best of {args.repeat}")
+    print(f"{'format':<10}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    for name, (dump_kws, load_kws) in formats.items():
+        text = utils.json_dumps(data, **dump_kws)
+        encode = min(
+            timeit.repeat(
+                lambda: utils.json_dumps(data, **dump_kws), number=1, repeat=args.repeat
+            )
+        )
+        decode = min(
+            timeit.repeat(
+                lambda: utils.json_loads(text, **load_kws), number=1, repeat=args.repeat
+            )
+        )
+        print(
+            f"{name:<10}{len(text.encode()):>12}{encode * 1000:>12.1f}{decode * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
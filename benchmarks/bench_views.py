@@ -0,0 +1,217 @@
+"""
+Measure wall time, query count and response size of the main travel views.
+
+Runs against the configured database, which should hold a scaled dataset
+(see the demo ``generate_load_data`` command):
+
+    PYTHONPATH=src:demo DJANGO_SETTINGS_MODULE=demo_proj.settings \\
+        python benchmarks/bench_views.py [--repeat N] [--save | --baseline FILE]
+
+``--save`` records the results as the baseline; later runs compare against it
+and exit with status 1 when a view is slower, issues more queries or renders
+more bytes than the thresholds allow.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import django
+
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+
+
+class Case:
+    def __init__(self, name, url, login=False):
+        self.name = name
+        self.url = url
+        self.login = login
+
+    def fetch(self, client):
+        response = client.get(self.url)
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"{self.name}: {self.url} returned {response.status_code}"
+            )
+
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+
+        return len(response.content)
+
+
+def has_listing(abbr):
+    from django.template import TemplateDoesNotExist, loader
+
+    try:
+        loader.get_template(f"travel/entities/listing/{abbr}.html")
+    except TemplateDoesNotExist:
+        return False
+
+    return True
+
+
+def get_cases(username):
+    from django.db.models import Count
+    from django.urls import reverse
+    from travel.models import TravelBucketList, TravelEntity, TravelEntityType
+
+    def url(name, *args):
+        return reverse(f"travel:{name}", args=args)
+
+    # The most logged country, so the entity page has the most to show
+    country = (
+        TravelEntity.objects.filter(type__abbr="co")
+        .annotate(logs=Count("travellog"))
+        .order_by("-logs", "id")
+        .first()
+    )
+    cases = [
+        Case("entity", url("entity", "co", country.code)),
+        Case("entity (logged in)", url("entity", "co", country.code), login=True),
+    ]
+    abbrs = TravelEntityType.objects.order_by("abbr").values_list("abbr", flat=True)
+    cases.extend(
+        Case(f"locale {abbr}", url("by-locale", abbr))
+        for abbr in abbrs
+        if has_listing(abbr)
+    )
+    cases.extend(
+        [
+            Case("search", url("search") + "?search=united"),
+            Case(
+                "advanced search",
+                url("search-advanced") + "?search=US%0AFR%0AParis",
+                login=True,
+            ),
+            Case("calendar", url("calendar", username)),
+            Case("calendar year", url("calendar", username) + "?view=year"),
+            Case("user log api", url("user_log_api", username), login=True),
+            Case("flag game api", url("flag_game_api")),
+            Case("flag game round", url("flag_game_round_api")),
+        ]
+    )
+    bucket = TravelBucketList.objects.filter(is_public=True).order_by("pk").first()
+    if bucket:
+        bucket_url = url("bucket", bucket.pk, username)
+        cases.append(Case("bucket list", bucket_url, login=True))
+
+    return cases
+
+
+def pick_user(username):
+    from django.contrib.auth.models import User
+    from django.db.models import Count
+    from travel.models import TravelProfile
+
+    users = User.objects.filter(travel_profile__access=TravelProfile.Access.PUBLIC)
+    if username:
+        return users.get(username=username)
+
+    # The public profile with the most logs
+    return users.annotate(logs=Count("travellog_set")).order_by("-logs", "id").first()
+
+
+def measure(case, client, repeat):
+    from django.db import connection, reset_queries
+    from django.test.utils import CaptureQueriesContext
+
+    size = case.fetch(client)  # Warm up caches
+    # The query log is bounded, so a full one would hide the new queries
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        case.fetch(client)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        case.fetch(client)
+        timings.append(time.perf_counter() - started)
+
+    return {
+        "best_ms": min(timings) * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "queries": len(queries),
+        "bytes": size,
+    }
+
+
+def regressions(results, baseline, args):
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        if result["median_ms"] > base["median_ms"] * (1 + args.time_threshold):
+            yield f"{name}: {base['median_ms']:.1f} -> {result['median_ms']:.1f} ms"
+        if result["queries"] > base["queries"] + args.query_threshold:
+            yield f"{name}: {base['queries']} -> {result['queries']} queries"
+        if result["bytes"] > base["bytes"] * (1 + args.bytes_threshold):
+            yield f"{name}: {base['bytes']} -> {result['bytes']} bytes"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--user", help="Username whose pages are measured")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="Save as the baseline")
+    parser.add_argument(
+        "--time-threshold",
+        type=float,
+        default=0.25,
+        help="Allowed fractional increase in median time",
+    )
+    parser.add_argument(
+        "--query-threshold", type=int, default=0, help="Allowed extra queries"
+    )
+    parser.add_argument(
+        "--bytes-threshold",
+        type=float,
+        default=0.1,
+        help="Allowed fractional increase in response size",
+    )
+    args = parser.parse_args()
+
+    django.setup()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    user = pick_user(args.user)
+    if user is None:
+        sys.exit("No public profiles found; run generate_load_data first.")
+
+    anonymous, logged_in = Client(), Client()
+    logged_in.force_login(user)
+
+    print(f"Profile {user.username}, median of {args.repeat}")
+    print(f"{'view':<24}{'best ms':>10}{'median ms':>11}{'queries':>9}{'bytes':>11}")
+    results = {}
+    for case in get_cases(user.username):
+        result = measure(case, logged_in if case.login else anonymous, args.repeat)
+        results[case.name] = result
+        print(
+            f"{case.name:<24}{result['best_ms']:>10.1f}{result['median_ms']:>11.1f}"
+            f"{result['queries']:>9}{result['bytes']:>11}"
+        )
+
+    if args.save:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        failed = list(regressions(results, baseline, args))
+        if failed:
+            print("\nRegressions against the baseline:")
+            print("\n".join(f"  {line}" for line in failed))
+            sys.exit(1)
+
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import datetime
+import itertools
+import random
+import time
+import unicodedata
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from travel.models import (
+    TravelAlias,
+    TravelAliasCategory,
+    TravelBucketList,
+    TravelEntity,
+    TravelLog,
+    TravelLogHistory,
+    TravelProfile,
+)
+
+USERNAME_PREFIX = "load-"
+ALIAS_CATEGORY = "Generated"
+RATINGS = [1, 2, 3, 4, 5]
+RATING_WEIGHTS = list(itertools.accumulate([5, 20, 45, 20, 10]))
+# Spread of the number of logs per user around the requested mean
+LOGS_SIGMA = 0.75
+# Dates are generated backwards from a fixed point so that runs are repeatable
+END = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Generator:
+    """
+    Builds users, logs, bucket lists and aliases from a seeded RNG, so the
+    same options always produce the same rows, apart from primary keys.
+
+    A user's logs come in trips: each trip picks a country, weighted so that
+    a few countries are far more popular than the rest, and logs the country
+    followed by a handful of the entities inside it over consecutive days.
+    Trips are more frequent in recent years.
+    """
+
+    def __init__(self, seed, batch_size, years):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.years = years
+        self.password = make_password("password")
+        self._load_entities()
+
+    def _load_entities(self):
+        self.entity_ids = []
+        self.countries = []
+        self.within = {}
+        rows = TravelEntity.objects.order_by("id").values_list(
+            "id", "type__abbr", "country_id"
+        )
+        for pk, abbr, country_id in rows:
+            self.entity_ids.append(pk)
+            if abbr == "co":
+                self.countries.append(pk)
+            elif country_id:
+                self.within.setdefault(country_id, []).append(pk)
+
+        if not self.countries:
+            raise CommandError("No countries found; run loaddb first.")
+
+        # Zipf-like popularity over a seeded shuffle of the countries
+        self.rng.shuffle(self.countries)
+        self.country_weights = list(
+            itertools.accumulate(
+                1 / (rank + 1) ** 0.9 for rank in range(len(self.countries))
+            )
+        )
+
+    def _flush(self, model, rows, force=False):
+        if rows and (force or len(rows) >= self.batch_size):
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+            rows.clear()
+
+    def users(self, count):
+        created = []
+        for i in range(count):
+            joined = END - datetime.timedelta(days=self.rng.randrange(3650))
+            created.append(
+                User(
+                    username=f"{USERNAME_PREFIX}{i:07d}",
+                    email=f"{USERNAME_PREFIX}{i:07d}@example.com",
+                    password=self.password,
+                    date_joined=joined,
+                )
+            )
+
+        User.objects.bulk_create(created, batch_size=self.batch_size)
+        users = list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX)
+            .order_by("username")
+            .values_list("id", flat=True)
+        )
+
+        # bulk_create skips the signal that creates profiles
+        access = TravelProfile.Access.values
+        TravelProfile.objects.bulk_create(
+            [
+                TravelProfile(user_id=pk, access=self.rng.choice(access))
+                for pk in users
+            ],
+            batch_size=self.batch_size,
+        )
+        return users
+
+    def _trip_start(self):
+        # Weighted towards the present: squaring a uniform sample
+        days = int(self.years * 365 * self.rng.random() ** 2)
+        start = END - datetime.timedelta(days=days)
+        return start.replace(
+            hour=self.rng.randrange(6, 22), minute=self.rng.randrange(60), second=0
+        )
+
+    def _trip(self):
+        country = self.rng.choices(self.countries, cum_weights=self.country_weights)[0]
+        inside = self.within.get(country, [])
+        stops = [country] + self.rng.sample(
+            inside, min(len(inside), int(self.rng.expovariate(1 / 3)))
+        )
+        when = self._trip_start()
+        for entity_id in stops:
+            yield entity_id, when
+            when += datetime.timedelta(
+                days=self.rng.randrange(3), hours=self.rng.randrange(12)
+            )
+
+    def logs(self, users, mean):
+        pending = []
+        total = 0
+        for user_id in users:
+            spread = self.rng.lognormvariate(-(LOGS_SIGMA**2) / 2, LOGS_SIGMA)
+            target = max(1, int(spread * mean))
+            count = 0
+            while count < target:
+                for entity_id, arrival in self._trip():
+                    pending.append(
+                        TravelLog(
+                            user_id=user_id,
+                            entity_id=entity_id,
+                            arrival=arrival,
+                            rating=self.rng.choices(
+                                RATINGS, cum_weights=RATING_WEIGHTS
+                            )[0],
+                        )
+                    )
+                    count += 1
+                self._flush(TravelLog, pending)
+
+            total += count
+
+        self._flush(TravelLog, pending, force=True)
+        return total
+
+    def bucketlists(self, users, share):
+        through = TravelBucketList.entities.through
+        links = []
+        count = 0
+        for user_id in users:
+            if self.rng.random() >= share:
+                continue
+
+            for _ in range(self.rng.randint(1, 3)):
+                count += 1
+                bucketlist = TravelBucketList.objects.create(
+                    owner_id=user_id,
+                    title=f"Bucket list {count}",
+                    is_public=self.rng.random() < 0.5,
+                )
+                size = min(len(self.entity_ids), self.rng.randint(10, 50))
+                entities = self.rng.sample(self.entity_ids, size)
+                links.extend(
+                    through(travelbucketlist_id=bucketlist.id, travelentity_id=pk)
+                    for pk in entities
+                )
+                self._flush(through, links)
+
+        self._flush(through, links, force=True)
+        return count
+
+    @staticmethod
+    def _variants(name, code):
+        plain = unicodedata.normalize("NFKD", name)
+        plain = "".join(c for c in plain if not unicodedata.combining(c))
+        variants = {plain, name.upper(), f"{name} ({code})"}
+        variants.discard(name)
+        return sorted(variants)
+
+    def aliases(self, share):
+        category, _ = TravelAliasCategory.objects.get_or_create(title=ALIAS_CATEGORY)
+        pending = []
+        count = 0
+        rows = TravelEntity.objects.order_by("id").values_list("id", "name", "code")
+        for pk, name, code in rows.iterator():
+            if self.rng.random() >= share:
+                continue
+
+            for alias in self._variants(name, code):
+                pending.append(
+                    TravelAlias(category=category, entity_id=pk, alias=alias)
+                )
+                count += 1
+            self._flush(TravelAlias, pending)
+
+        self._flush(TravelAlias, pending, force=True)
+        return count
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible, synthetic load dataset of users, travel logs, "
+        "bucket lists and aliases on top of the loaddb sample data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument(
+            "--logs", type=int, default=1000, help="Mean number of logs per user"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--years", type=int, default=30, help="How far back logs may go"
+        )
+        parser.add_argument(
+            "--bucketlists",
+            type=float,
+            default=0.2,
+            help="Share of users with bucket lists",
+        )
+        parser.add_argument(
+            "--aliases", type=float, default=0.1, help="Share of entities given aliases"
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Remove previously generated data first",
+        )
+
+    def step(self, title, fn, *args):
+        self.stdout.write(f"{title}...")
+        started = time.time()
+        result = fn(*args)
+        self.stdout.write(f"Done in {time.time() - started:.1f} second(s).")
+        return result
+
+    @staticmethod
+    def fast_delete(model, field, qs):
+        # Skips the per-row delete signals, whose work is redone afterwards.
+        # Rows are picked by a foreign key rather than by their own pks, as
+        # MySQL rejects a delete whose subquery reads the same table.
+        sql, params = qs.values("pk").query.sql_with_params()
+        table = connection.ops.quote_name(model._meta.db_table)
+        column = connection.ops.quote_name(model._meta.get_field(field).column)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({sql})", params)
+
+    def clear(self):
+        users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        self.fast_delete(TravelLog, "user", users)
+        self.fast_delete(
+            TravelAlias,
+            "category",
+            TravelAliasCategory.objects.filter(title=ALIAS_CATEGORY),
+        )
+        users.delete()
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        if options["clear"]:
+            self.step("Removing generated data", self.clear)
+        elif User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError(
+                "Generated data already exists; use --clear to replace it."
+            )
+
+        gen = Generator(options["seed"], options["batch_size"], options["years"])
+        users = self.step("Creating users", gen.users, options["users"])
+        logs = self.step("Creating logs", gen.logs, users, options["logs"])
+        lists = self.step(
+            "Creating bucket lists", gen.bucketlists, users, options["bucketlists"]
+        )
+        aliases = self.step("Creating aliases", gen.aliases, options["aliases"])
+
+        # bulk_create bypasses the signals that maintain these
+        TravelLogHistory.objects.filter(user__in=users).delete()
+        for pk in users:
+            TravelLog.objects.clear_checklist(pk)
+        call_command("rebuild_search_index", stdout=self.stdout)
+
+        self.stdout.write(
+            f"Created {len(users)} users, {logs} logs, {lists} bucket lists "
+            f"and {aliases} aliases."
+        )
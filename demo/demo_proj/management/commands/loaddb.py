@@ -1,5 +1,6 @@
 import time
 from django.contrib.sites.models import Site
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 
@@ -41,4 +42,7 @@ class Command(BaseCommand):
             done = time.time() - started
             self.stdout.write(f"Done in {done} second(s).")
 
+        call_command("rebuild_search_index", stdout=self.stdout)
+        call_command("rebuild_entity_closure", stdout=self.stdout)
+        call_command("warm_relationship_cache", stdout=self.stdout)
         self.stdout.write("Seeding done.")
@@ -1,8 +1,11 @@
+import hashlib
+import json
 from itertools import chain
 from rest_framework import serializers
 
 from django.contrib.auth.models import User
-from travel.models import TravelLog, TravelEntity
+from travel import caching
+from travel.models import TravelLog, TravelLogHistory, TravelEntity
 from travel.extras import games
 
 
@@ -52,12 +55,18 @@ class TravelUserLogSerializer(serializers.ModelSerializer):
         fields = ["username", "logs", "entities"]
 
     def get_logs(self, obj):
-        return TravelLogSerializer(TravelLog.objects.filter(user=obj), many=True).data
+        return TravelLogSerializer(
+            TravelLog.objects.filter(user=obj).order_by(
+                *TravelLogHistory.objects.LOG_ORDERING
+            ),
+            many=True,
+        ).data
 
     def get_entities(self, obj):
         return TravelEntitySerializer(
             TravelEntity.objects.filter(travellog__user=obj)
             .distinct()
+            .order_by(*TravelLogHistory.objects.ENTITY_ORDERING)
             .select_related("country", "flag", "country__flag", "type"),
             many=True,
         ).data
@@ -75,9 +84,23 @@ def flag_data():
     return {
         "countries": FlagEntitySerializer(
             TravelEntity.objects.countries()
-            .filter(code__in={*chain(*games.FLAG_GROUPS)})
+            .filter(code__in={*chain(*games.FLAG_GROUPS)}, flag__isnull=False)
+            .exclude(flag__svg="")
             .select_related("flag"),
             many=True,
         ).data,
         "groups": games.FLAG_GROUPS,
     }
+
+
+def render_flag_data():
+    data = json.dumps(flag_data(), ensure_ascii=False, separators=(",", ":"))
+    return data, '"{}"'.format(hashlib.md5(data.encode()).hexdigest())
+
+
+def flag_game_payload():
+    """
+    The rendered ``flag_data`` JSON and its ETag, kept in the cache until a
+    flag or entity is saved or deleted.
+    """
+    return caching.get_or_set(caching.versioned_key("flag-game"), render_flag_data)
@@ -3,5 +3,13 @@ from . import views
 
 urlpatterns = [
     path("logs/<str:username>/", views.UserLogListView.as_view(), name="user_log_api"),
+    path(
+        "logs/<str:username>/import/",
+        views.UserLogImportView.as_view(),
+        name="user_log_import_api",
+    ),
     path("flag-game/", views.FlagGameView.as_view(), name="flag_game_api"),
+    path(
+        "flag-game/round/", views.FlagRoundView.as_view(), name="flag_game_round_api"
+    ),
 ]
@@ -1,20 +1,122 @@
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.utils.cache import (
+    add_never_cache_headers,
+    get_conditional_response,
+    patch_cache_control,
+)
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import generics, mixins
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import NotFound, PermissionDenied
+from rest_framework.parsers import MultiPartParser
+from travel import importer
+from travel.extras import games
+from travel.models import TravelLogHistory
 from . import serializers
 
 
 class FlagGameView(APIView):
+    """
+    Serves the cached flag game payload with a strong ETag, answering with a
+    304 when the client already holds it.
+    """
+
+    query_budget = 2
 
     def get(self, request):
-        return Response(serializers.flag_data())
+        data, etag = serializers.flag_game_payload()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(data, content_type="application/json")
+
+        response["ETag"] = etag
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=getattr(settings, "TRAVEL_FLAG_GAME_MAX_AGE", 60 * 60),
+        )
+        return response
+
 
+class FlagRoundView(APIView):
+    """
+    Serves one flag game round: a country name and four flags to choose from.
+    """
+
+    query_budget = 2
+
+    def get(self, request):
+        game_round = games.make_round(games.get_round_index())
+        if game_round is None:
+            raise NotFound("Not enough flags to play.")
+
+        response = Response(game_round)
+        add_never_cache_headers(response)
+        return response
+
+
+class UserLogListView(generics.GenericAPIView):
+    """
+    Serves the user's pre-rendered history payload, answering with a 304 when
+    the client already holds the current version.
+    """
 
-class UserLogListView(mixins.RetrieveModelMixin, generics.GenericAPIView):
     queryset = User.objects.all()
     serializer_class = serializers.TravelUserLogSerializer
     lookup_field = "username"
+    query_budget = 12
 
     def get(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+        history = TravelLogHistory.objects.for_user(self.get_object())
+        response = get_conditional_response(request, etag=history.etag)
+        if response is None:
+            response = HttpResponse(history.data, content_type="application/json")
+
+        response["ETag"] = history.etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class UserLogImportView(generics.GenericAPIView):
+    """
+    Imports the logs in an uploaded CSV, JSON or GPX file (field ``file``) for
+    the requesting user. The format is taken from the ``format`` parameter or
+    the file name, and ``type`` gives the entity type for rows that omit it.
+    """
+
+    queryset = User.objects.all()
+    lookup_field = "username"
+    parser_classes = [MultiPartParser]
+    permission_classes = [permissions.IsAuthenticated]
+
+    @staticmethod
+    def bad_request(detail):
+        return Response({"detail": detail}, status.HTTP_400_BAD_REQUEST)
+
+    def post(self, request, *args, **kwargs):
+        user = self.get_object()
+        if user != request.user:
+            raise PermissionDenied()
+
+        upload = request.data.get("file")
+        if upload is None:
+            return self.bad_request("No file uploaded.")
+
+        params = request.query_params
+        format = params.get("format") or importer.guess_format(upload.name)
+        if format not in importer.FORMATS:
+            return self.bad_request("Unknown file format.")
+
+        try:
+            result = importer.import_logs(user, upload, format, params.get("type"))
+        except ValueError as err:
+            return self.bad_request(str(err))
+
+        return Response(
+            {
+                "created": result.created,
+                "errors": [{"line": line, "error": msg} for line, msg in result.errors],
+            }
+        )
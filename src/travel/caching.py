@@ -0,0 +1,66 @@
+"""
+Keys and timeouts for the structures travel keeps in Django's cache framework.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = "travel"
+
+
+def make_key(*bits):
+    return ":".join([KEY_PREFIX, *[str(bit) for bit in bits]])
+
+
+def get_timeout():
+    return getattr(settings, "TRAVEL_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+def get_or_set(key, default):
+    return cache.get_or_set(key, default, get_timeout())
+
+
+def delete(key):
+    cache.delete(key)
+
+
+def get_many(keys):
+    return cache.get_many(keys)
+
+
+def set_many(data):
+    cache.set_many(data, get_timeout())
+
+
+def delete_many(keys):
+    cache.delete_many(keys)
+
+
+def get_version(name):
+    """
+    The current generation of the ``name`` namespace. Keys built with
+    ``versioned_key`` are all invalidated at once by ``bump_version``.
+    """
+    key = make_key("version", name)
+    version = cache.get(key)
+    if version is None:
+        # Start from a random generation rather than 1, so that a version
+        # lost to eviction or a cache clear can't match one already handed
+        # out and still held by a process-local snapshot.
+        cache.add(key, random.randrange(1, 2**31), None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_version(name):
+    key = make_key("version", name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return get_version(name)
+
+
+def versioned_key(name, *bits):
+    return make_key(name, get_version(name), *bits)
@@ -1,15 +1,33 @@
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.utils.functional import SimpleLazyObject
+
 from travel import forms
 from travel.models import TravelLog
-from django.contrib.sites.models import Site
+
+DEFAULTS = {
+    "site": True,
+    "search_form": True,
+    "checklist": True,
+}
 
 
 def _checklist(user):
-    return TravelLog.objects.checklist(user) if user.is_authenticated else {}
+    return TravelLog.objects.cached_checklist(user) if user.is_authenticated else frozenset()
 
 
 def search(request):
+    """
+    Each value is only computed if a template actually uses it. Individual
+    values can be turned off with the ``TRAVEL_CONTEXT_PROCESSOR`` setting,
+    e.g. ``{"checklist": False}``.
+    """
+    enabled = dict(DEFAULTS, **getattr(settings, "TRAVEL_CONTEXT_PROCESSOR", {}))
+    loaders = {
+        "site": lambda: Site.objects.get_current(request),
+        "search_form": forms.SearchForm,
+        "checklist": lambda: _checklist(request.user),
+    }
     return {
-        "site": Site.objects.get_current(),
-        "search_form": forms.SearchForm(),
-        "checklist": _checklist(request.user),
+        key: SimpleLazyObject(loader) for key, loader in loaders.items() if enabled[key]
     }
@@ -1,3 +1,26 @@
+"""
+Flag game rounds.
+
+``FLAG_GROUPS`` are hand-picked sets of flags that are easily confused. The
+round generator extends them to every country with a flag SVG: the
+similarity index ranks, for each country, the others that share a
+``FLAG_GROUPS`` set, a subregion, a region or flag colours, and a round
+pairs the country with distractors drawn from the top of its ranking.
+
+Reading every flag SVG for its colours is the slow part of building the
+index, so the colours of each file are cached by its size and modification
+time, and only new or changed files are read.
+"""
+import hashlib
+import random
+import re
+from collections import defaultdict
+from itertools import combinations
+
+from django.core.files.storage import default_storage
+
+from travel import caching
+
 FLAG_GROUPS = [
     ["AT", "LV", "PE", "PF"],
     ["AX", "FO", "NO", "IS"],
@@ -65,3 +88,192 @@ FLAG_GROUPS = [
     ["GT", "MX", "PY", "AR"],
     ["IO", "KI", "CK"],
 ]
+
+
+CHOICES = 4
+SIMILAR_COUNT = 8
+
+# Colours that flags are made of, for grouping flags by their palette
+PALETTE = {
+    "red": (200, 16, 46),
+    "maroon": (128, 0, 32),
+    "orange": (255, 130, 0),
+    "yellow": (252, 209, 22),
+    "green": (0, 122, 61),
+    "lightblue": (117, 170, 219),
+    "blue": (0, 56, 168),
+    "white": (255, 255, 255),
+    "black": (0, 0, 0),
+}
+NAMED_COLOURS = {
+    "red": "#f00",
+    "white": "#fff",
+    "black": "#000",
+    "blue": "#00f",
+    "navy": "#000080",
+    "green": "#008000",
+    "yellow": "#ff0",
+    "orange": "#ffa500",
+}
+COLOUR = re.compile(
+    r"#([0-9a-f]{6}|[0-9a-f]{3})\b|(?:fill|stop-color)[=:]\s*\"?([a-z]+)", re.I
+)
+
+
+def nearest_colour(hex_value):
+    if len(hex_value) == 3:
+        hex_value = "".join(c * 2 for c in hex_value)
+
+    rgb = list(bytes.fromhex(hex_value))
+    return min(
+        PALETTE,
+        key=lambda name: sum((a - b) ** 2 for a, b in zip(rgb, PALETTE[name])),
+    )
+
+
+def flag_colours(svg):
+    """
+    The ``PALETTE`` colours nearest to the colours used in the text ``svg``.
+    """
+    colours = set()
+    for hex_value, name in COLOUR.findall(svg):
+        if name:
+            hex_value = NAMED_COLOURS.get(name.lower(), "")[1:]
+        if hex_value:
+            colours.add(nearest_colour(hex_value))
+
+    return colours
+
+
+def _read_colours(name):
+    try:
+        with default_storage.open(name) as fp:
+            return flag_colours(fp.read().decode("utf-8", "replace"))
+    except OSError:
+        return set()
+
+
+def _colours_key(name):
+    stamp = "{}:{}:{}".format(
+        name,
+        default_storage.size(name),
+        default_storage.get_modified_time(name).timestamp(),
+    )
+    return caching.make_key("flag-colours", hashlib.md5(stamp.encode()).hexdigest())
+
+
+def read_colours(names):
+    """
+    The ``PALETTE`` colours of each flag SVG in ``names``, as a dict.
+    """
+    keys = {}
+    for name in names:
+        try:
+            keys[name] = _colours_key(name)
+        except OSError:
+            pass
+
+    cached = caching.get_many(keys.values())
+    colours, found = {}, {}
+    for name in names:
+        key = keys.get(name)
+        if key is None:
+            colours[name] = set()
+        elif key in cached:
+            colours[name] = cached[key]
+        else:
+            colours[name] = found[key] = _read_colours(name)
+
+    caching.set_many(found)
+    return colours
+
+
+def similarity_index(countries):
+    """
+    Rank the most similar flags for each country. ``countries`` are
+    ``(code, region, subregion, colours)`` tuples. Returns a dict of codes to
+    lists of at most ``SIMILAR_COUNT`` codes, most similar first.
+    """
+    groups = defaultdict(set)
+    for group in FLAG_GROUPS:
+        for code in group:
+            groups[code].update(group)
+
+    scores = defaultdict(dict)
+    for a, b in combinations(countries, 2):
+        (code_a, region_a, sub_a, colours_a) = a
+        (code_b, region_b, sub_b, colours_b) = b
+        score = 3 if code_b in groups[code_a] else 0
+        if sub_a and sub_a == sub_b:
+            score += 2
+        elif region_a and region_a == region_b:
+            score += 1
+        if colours_a or colours_b:
+            score += 2 * len(colours_a & colours_b) / len(colours_a | colours_b)
+        if score:
+            scores[code_a][code_b] = scores[code_b][code_a] = score
+
+    def ranked(code):
+        others = scores[code]
+        return sorted(others, key=lambda other: (-others[other], other))
+
+    return {code: ranked(code)[:SIMILAR_COUNT] for code, *_ in countries}
+
+
+def build_round_index():
+    from travel.models import TravelEntity
+
+    rows = (
+        TravelEntity.objects.countries()
+        .filter(flag__isnull=False)
+        .exclude(flag__svg="")
+        .select_related(None)
+        .order_by("code")
+        .values_list(
+            "code", "name", "flag__svg", "entityinfo__region", "entityinfo__subregion"
+        )
+    )
+    rows = list(rows)
+    colours = read_colours([svg for _, _, svg, _, _ in rows])
+    countries = {}
+    features = []
+    for code, name, svg, region, subregion in rows:
+        countries[code] = [name, default_storage.url(svg)]
+        features.append((code, region, subregion, colours[svg]))
+
+    return {"countries": countries, "similar": similarity_index(features)}
+
+
+def get_round_index():
+    """
+    The countries with flags and their similarity index, cached until a
+    change to a country, its flag or its region.
+    """
+    return caching.get_or_set(
+        caching.versioned_key("flag-game", "rounds"), build_round_index
+    )
+
+
+def make_round(index, rng=random):
+    """
+    One round of the flag game: a country to find and ``CHOICES`` flags,
+    including its own and others most like it. Returns None when there are
+    too few flags to play.
+    """
+    countries = index["countries"]
+    if len(countries) < CHOICES:
+        return None
+
+    codes = sorted(countries)
+    answer = rng.choice(codes)
+    similar = index["similar"].get(answer, [])
+    choices = rng.sample(similar, min(len(similar), CHOICES - 1))
+    others = [code for code in codes if code != answer and code not in choices]
+    choices += rng.sample(others, CHOICES - 1 - len(choices))
+    choices.append(answer)
+    rng.shuffle(choices)
+    return {
+        "name": countries[answer][0],
+        "code": answer,
+        "flags": [{"code": code, "image": countries[code][1]} for code in choices],
+    }
@@ -1,15 +1,21 @@
+import json
+import os
 from datetime import datetime, date
+from functools import lru_cache
 
 from django import forms
+from django.conf import settings
 from django.core.validators import EMPTY_VALUES
 
-from dateutil.zoneinfo import get_zonefile_instance
-
 from . import models as travel
 from . import utils as travel_utils
 
 
-def _tz_choices():
+def build_tz_choices():
+    # Reads every zone out of dateutil's bundled tarball, so keep it out of
+    # import time
+    from dateutil.zoneinfo import get_zonefile_instance
+
     choices = []
     nested = {}
     zi = get_zonefile_instance()
@@ -29,7 +35,33 @@ def _tz_choices():
     return choices
 
 
-TZ_CHOICES = _tz_choices()
+def tz_choices_path():
+    return getattr(settings, "TRAVEL_TZ_CHOICES_FILE", None)
+
+
+@lru_cache(maxsize=None)
+def tz_choices():
+    """
+    Timezone choices, grouped by region. Built on first use and then kept for
+    the life of the process; read from ``TRAVEL_TZ_CHOICES_FILE`` (written by
+    the ``build_tz_choices`` command) when that file exists.
+    """
+    path = tz_choices_path()
+    if path and os.path.exists(path):
+        with open(path) as fp:
+            return [
+                (key, [tuple(c) for c in value] if isinstance(value, list) else value)
+                for key, value in json.load(fp)
+            ]
+
+    return build_tz_choices()
+
+
+def __getattr__(name):
+    if name == "TZ_CHOICES":
+        return tz_choices()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class SearchField(forms.CharField):
@@ -132,7 +164,7 @@ class LatLonField(forms.CharField):
 
 class BaseTravelEntityForm(forms.ModelForm):
     tz = forms.ChoiceField(
-        label="Timezone", required=False, choices=TZ_CHOICES, initial="UTC"
+        label="Timezone", required=False, choices=tz_choices, initial="UTC"
     )
     lat_lon = LatLonField(label="Lat/Lon", required=False)
     flag_url = forms.CharField(label="Flag URL", required=False)
@@ -0,0 +1,249 @@
+"""
+Bulk import of travel logs from CSV, JSON or GPX files.
+
+Every format yields the same records: an entity ``type`` abbreviation, an
+entity ``code`` (as in entity URLs, e.g. ``US`` or ``FR-A`` for states), an
+``arrival`` date/time in the entity's local time unless it carries an offset,
+and optional ``rating`` and ``notes``.
+
+* CSV: a header row naming those columns.
+* JSON: JSON Lines (one object per line) are read incrementally; a single
+  top-level array is also accepted but read in one go.
+* GPX: ``<wpt>`` elements, with the code in ``<name>``, the type in ``<type>``,
+  the arrival in ``<time>`` and notes in ``<desc>``.
+
+Rows are processed in batches: entities for a batch are looked up with one
+query per entity type, and logs are written with ``bulk_create``. A row that
+cannot be imported is reported with its line (or record) number and skipped;
+a file that cannot be read at all raises ``ValueError``, keeping the batches
+already written.
+"""
+import csv
+import io
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from itertools import islice
+from xml.etree import ElementTree
+
+from dateutil.tz import UTC
+
+from . import registry as travel_registry
+from . import utils as travel_utils
+from .models import TravelEntity, TravelLog, TravelLogHistory
+
+FORMATS = ("csv", "json", "gpx")
+GPX_NS = "{http://www.topografix.com/GPX/1/1}"
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    errors: list = field(default_factory=list)
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+def guess_format(name):
+    ext = os.path.splitext(name)[1].lstrip(".").lower()
+    if ext == "jsonl":
+        return "json"
+
+    return ext if ext in FORMATS else None
+
+
+@contextmanager
+def _text(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        yield text
+    except UnicodeDecodeError as err:
+        raise ValueError(f"Invalid UTF-8 text: {err.reason}")
+    finally:
+        # Leave closing the underlying file to the caller
+        text.detach()
+
+
+def read_csv(stream):
+    with _text(stream) as text:
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def read_json(stream):
+    with _text(stream) as text:
+        line_num = 0
+        while line := text.readline():
+            line_num += 1
+            if not line.strip():
+                continue
+
+            if line_num == 1 and line.lstrip().startswith("["):
+                for i, record in enumerate(json.loads(line + text.read()), 1):
+                    yield i, record
+                return
+
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as err:
+                yield line_num, err
+
+
+def read_gpx(stream):
+    count = 0
+    try:
+        for _, elem in ElementTree.iterparse(stream):
+            if elem.tag.removeprefix(GPX_NS) != "wpt":
+                continue
+
+            count += 1
+            children = {child.tag.removeprefix(GPX_NS): child.text for child in elem}
+            yield count, {
+                "type": children.get("type"),
+                "code": children.get("name"),
+                "arrival": children.get("time"),
+                "notes": children.get("desc"),
+            }
+            elem.clear()
+    except ElementTree.ParseError as err:
+        raise ValueError(f"Invalid GPX: {err}")
+
+
+READERS = {"csv": read_csv, "json": read_json, "gpx": read_gpx}
+
+
+class LogImporter:
+    batch_size = 500
+
+    def __init__(self, user, default_type=None, batch_size=None):
+        self.user = user
+        self.default_type = default_type
+        self.batch_size = batch_size or self.batch_size
+        self._tzinfo = {}
+
+    def run(self, stream, format):
+        result = ImportResult()
+        records = READERS[format](stream)
+        try:
+            while batch := list(islice(records, self.batch_size)):
+                self._import_batch(batch, result)
+        finally:
+            if result.created:
+                # bulk_create bypasses the signals that maintain these
+                TravelLog.objects.clear_checklist(self.user.pk)
+                TravelLogHistory.objects.filter(user=self.user).delete()
+
+        return result
+
+    def _split(self, record):
+        if isinstance(record, Exception):
+            raise ValueError(f"Invalid record: {record}")
+        if not isinstance(record, dict):
+            raise ValueError("Record must be an object")
+
+        abbr = (record.get("type") or self.default_type or "").strip()
+        code = (record.get("code") or "").strip()
+        if not (abbr and code):
+            raise ValueError("Missing entity type or code")
+
+        code, aux = code.split("-", 1) if "-" in code else (code, None)
+        return abbr, code, aux
+
+    def _find_entities(self, keys):
+        """
+        Map ``(abbr, code, aux)`` keys to the entities they match, as
+        ``TravelEntityManager.find`` would, with one query per entity type.
+        """
+        found = {}
+        by_type = {}
+        for abbr, code, aux in keys:
+            by_type.setdefault(abbr, set()).add(aux or code)
+
+        for abbr, codes in by_type.items():
+            type_id = travel_registry.entity_types.pk_for(abbr)
+            if type_id is None:
+                continue
+
+            qs = TravelEntity.objects.filter(type_id=type_id, code__in=codes)
+            for entity in qs.select_related("country", "state", "type"):
+                country = entity.country.code if entity.country else None
+                found.setdefault((abbr, entity.code, None), []).append(entity)
+                found.setdefault((abbr, country, entity.code), []).append(entity)
+
+        return found
+
+    def _tz(self, entity):
+        if entity.id not in self._tzinfo:
+            self._tzinfo[entity.id] = entity.tzinfo
+
+        return self._tzinfo[entity.id]
+
+    def _arrival(self, value, entity):
+        if not value:
+            raise ValueError("Missing arrival")
+
+        try:
+            when = travel_utils.dt_parser(str(value))
+        except (ValueError, OverflowError):
+            raise ValueError(f"Invalid arrival: {value}")
+
+        if when.tzinfo is not None:
+            return when.astimezone(UTC)
+
+        return travel_utils.normalize_datetime_zone(when, self._tz(entity))
+
+    @staticmethod
+    def _rating(value):
+        if value in (None, ""):
+            return 3
+
+        try:
+            rating = int(value)
+        except (TypeError, ValueError):
+            rating = None
+
+        if rating not in dict(TravelLog.RATING_CHOICES):
+            raise ValueError(f"Invalid rating: {value}")
+
+        return rating
+
+    def _import_batch(self, batch, result):
+        keyed = []
+        for line, record in batch:
+            try:
+                keyed.append((line, record, self._split(record)))
+            except ValueError as err:
+                result.error(line, str(err))
+
+        entities = self._find_entities({key for _, _, key in keyed})
+        logs = []
+        for line, record, key in keyed:
+            matches = entities.get(key, [])
+            if len(matches) != 1:
+                problem = "Ambiguous" if matches else "Unknown"
+                result.error(line, f"{problem} entity: {key[0]} {record['code']}")
+                continue
+
+            entity = matches[0]
+            try:
+                logs.append(
+                    TravelLog(
+                        user=self.user,
+                        entity=entity,
+                        arrival=self._arrival(record.get("arrival"), entity),
+                        rating=self._rating(record.get("rating")),
+                        notes=record.get("notes") or "",
+                    )
+                )
+            except ValueError as err:
+                result.error(line, str(err))
+
+        TravelLog.objects.bulk_create(logs)
+        result.created += len(logs)
+
+
+def import_logs(user, stream, format, default_type=None, batch_size=None):
+    return LogImporter(user, default_type, batch_size).run(stream, format)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from travel.models import TravelFlag
+from travel.sprites import SPRITE_NAME, flag_sprite
+
+
+class Command(BaseCommand):
+    help = "Compile every flag SVG into one sprite of <symbol> elements."
+
+    def handle(self, *args, **options):
+        flags = TravelFlag.objects.exclude(svg="").values_list("pk", "svg")
+        count, skipped = flag_sprite.rebuild(flags.order_by("pk"))
+        self.stdout.write(f"Wrote {count} flags to {SPRITE_NAME}.")
+        if skipped:
+            self.stderr.write(
+                f"Skipped {len(skipped)} unreadable flags: "
+                + ", ".join(str(pk) for pk in skipped)
+            )
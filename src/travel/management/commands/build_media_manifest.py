@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from travel.manifest import manifest_path, media_manifest
+
+
+class Command(BaseCommand):
+    help = "Record which travel images exist under MEDIA_ROOT in the media manifest."
+
+    def handle(self, *args, **options):
+        count = media_manifest.rebuild()
+        self.stdout.write(f"Wrote {count} files to {manifest_path()}.")
@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from travel import forms
+
+
+class Command(BaseCommand):
+    help = "Write the timezone choices used by the entity forms to a JSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", help="Output file (default: TRAVEL_TZ_CHOICES_FILE)"
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"] or forms.tz_choices_path()
+        if not path:
+            raise CommandError("Give a path or set TRAVEL_TZ_CHOICES_FILE")
+
+        choices = forms.build_tz_choices()
+        with open(path, "w") as fp:
+            json.dump(choices, fp, separators=(",", ":"))
+
+        self.stdout.write(f"Wrote {len(choices)} timezone choices to {path}")
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from travel import importer
+
+
+class Command(BaseCommand):
+    help = "Import travel logs for a user from a CSV, JSON or GPX file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=importer.FORMATS)
+        parser.add_argument("--type", help="Entity type for rows that don't give one")
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['username']}")
+
+        format = options["format"] or importer.guess_format(options["path"])
+        if format is None:
+            raise CommandError("Cannot tell the file format, use --format")
+
+        with open(options["path"], "rb") as fp:
+            try:
+                result = importer.import_logs(
+                    user, fp, format, options["type"], options["batch_size"]
+                )
+            except ValueError as err:
+                raise CommandError(f"Could not read {options['path']}: {err}")
+
+        for line, message in result.errors:
+            self.stderr.write(f"{line}: {message}")
+
+        self.stdout.write(
+            f"Imported {result.created} logs, {len(result.errors)} errors."
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from travel import caching
+from travel.models import TravelEntity, TravelEntityClosure
+
+
+class Command(BaseCommand):
+    help = (
+        "Repopulate the entity ancestor/descendant closure table and the "
+        "timezones entities inherit through it."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding entity closure...")
+        count = TravelEntityClosure.objects.rebuild()
+        self.stdout.write(f"Wrote {count} rows.")
+        caching.bump_version("relationships")
+
+        self.stdout.write("Resolving timezones...")
+        count = TravelEntity.objects.refresh_timezones()
+        self.stdout.write(f"Updated {count} entities.")
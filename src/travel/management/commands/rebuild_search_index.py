@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from travel import search
+from travel.models import TravelSearchToken
+
+
+class Command(BaseCommand):
+    help = "Create (if needed) and repopulate the entity search index and tokens."
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        self.stdout.write(f"Rebuilding search index using {type(backend).__name__}...")
+        backend.install()
+        count = backend.rebuild()
+        self.stdout.write(f"Indexed {count} entities.")
+
+        self.stdout.write("Rebuilding search tokens...")
+        count = TravelSearchToken.objects.rebuild()
+        self.stdout.write(f"Wrote {count} tokens.")
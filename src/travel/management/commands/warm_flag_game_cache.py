@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from travel.api.serializers import flag_game_payload
+
+
+class Command(BaseCommand):
+    help = "Precompute the cached flag game payload served by the API."
+
+    def handle(self, *args, **options):
+        data, etag = flag_game_payload()
+        self.stdout.write(f"Cached {len(data)} bytes of flag game data, ETag {etag}.")
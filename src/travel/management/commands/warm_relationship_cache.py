@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from travel.models import TravelEntity
+
+
+class Command(BaseCommand):
+    help = "Precompute the cached relationship counts shown on entity pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "types",
+            nargs="*",
+            help="Entity type abbreviations to warm (default: co cn)",
+        )
+
+    def handle(self, *args, **options):
+        types = options["types"] or ["co", "cn"]
+        unknown = set(types) - set(TravelEntity.Related.ENTITY_TYPES)
+        if unknown:
+            raise CommandError(f"Unknown entity types: {', '.join(sorted(unknown))}")
+
+        self.stdout.write(f"Warming relationship counts for {', '.join(types)}...")
+        count = TravelEntity.warm_relationships(types)
+        self.stdout.write(f"Cached {count} entities.")
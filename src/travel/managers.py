@@ -1,12 +1,25 @@
+import hashlib
+import json
 import operator
+from datetime import datetime
 from functools import reduce
+from itertools import islice
+from django.db import transaction
 from django.db.models import Manager, Q, Count
 
+from . import caching
+from . import registry as travel_registry
+from . import search as travel_search
+from . import utils as travel_utils
+
 __all__ = (
     "TravelProfileManager",
     "TravelBucketListManager",
     "TravelEntityManager",
     "TravelLogManager",
+    "TravelSearchTokenManager",
+    "TravelEntityClosureManager",
+    "TravelLogHistoryManager",
 )
 
 
@@ -47,7 +60,6 @@ class TravelEntityManager(Manager):
     search_select_related = [
         "type",
         "flag",
-        "classification",
         "country",
         "country__flag",
         "country__type",
@@ -58,7 +70,6 @@ class TravelEntityManager(Manager):
         "country",
         "country__flag",
         "country__type",
-        "classification",
     ]
     state_select_related = [
         "state",
@@ -68,6 +79,7 @@ class TravelEntityManager(Manager):
         "state__country__type",
     ]
     capital_select_related = ["capital", "capital__type"]
+    fuzzy_chunk_size = 100
     common_select_related = base_select_related + state_select_related
 
     select_related_by_type = {
@@ -82,13 +94,10 @@ class TravelEntityManager(Manager):
         "lm": common_select_related,
     }
 
-    @staticmethod
-    def _search_q(term):
-        return (
-            Q(name__icontains=term)
-            | Q(full_name__icontains=term)
-            | Q(locality__icontains=term)
-            | Q(code__iexact=term)
+    def _search_q(self, term):
+        tokens = self.model._meta.get_field("search_tokens").related_model.objects
+        return travel_search.get_backend().q(term) | Q(
+            id__in=tokens.prefix(term).values("entity")
         )
 
     def search(self, term, type=None):
@@ -98,20 +107,80 @@ class TravelEntityManager(Manager):
 
         qs = self.filter(self._search_q(term))
         if type:
-            qs = qs.filter(type__abbr=type)
+            qs = qs.filter(type_id=travel_registry.entity_types.pk_for(type))
 
         return qs.select_related(*self.search_select_related)
 
-    def advanced_search(self, bits, type=None):
-        bits = [b.strip() for b in bits]
-        qq = reduce(operator.ior, [self._search_q(term) for term in bits])
-        qs = self.filter(qq)
+    def resolve(self, lines, type=None):
+        """
+        Map each distinct, non-blank line to the ids of the entities it
+        matches, using a bounded number of queries regardless of line count.
+
+        Lines equal to a complete normalized name, code or alias are resolved
+        with a single ``IN`` lookup on the search tokens. Only the remaining
+        lines fall back to the fuzzy match used by ``search``, issued as one
+        query and attributed back to its lines in Python.
+        """
+        tokens = self.model._meta.get_field("search_tokens").related_model.objects
+        normalized = {}
+        for line in lines:
+            line = line.strip()
+            if line and line not in normalized:
+                normalized[line] = travel_utils.normalize_search_text(line)
+
+        exact = tokens.filter(is_complete=True, token__in=set(normalized.values()))
         if type:
-            qs = qs.filter(type__abbr=type)
+            type_id = travel_registry.entity_types.pk_for(type)
+            exact = exact.filter(entity__type_id=type_id)
 
-        return qs.select_related(*self.search_select_related)
+        by_token = {}
+        for token, entity_id in exact.values_list("token", "entity"):
+            by_token.setdefault(token, set()).add(entity_id)
+
+        resolved = {line: by_token.get(token, set()) for line, token in normalized.items()}
+        leftover = iter([line for line, ids in resolved.items() if not ids])
+        while chunk := list(islice(leftover, self.fuzzy_chunk_size)):
+            self._resolve_fuzzy(chunk, normalized, resolved, tokens, type)
+
+        return {line: sorted(ids) for line, ids in resolved.items()}
+
+    def _resolve_fuzzy(self, lines, normalized, resolved, tokens, type):
+        type_id = travel_registry.entity_types.pk_for(type) if type else None
+        qs = self.filter(travel_search.get_backend().q_many(lines))
+        if type:
+            qs = qs.filter(type_id=type_id)
+
+        folded = {line: line.casefold() for line in lines}
+        for row in qs.values_list("id", "code", *travel_search.SEARCH_FIELDS):
+            entity_id, code = row[0], row[1].casefold()
+            values = [value.casefold() for value in row[2:]]
+            for line, term in folded.items():
+                if term == code or any(term in value for value in values):
+                    resolved[line].add(entity_id)
+
+        prefixes = {}
+        for line in lines:
+            if normalized[line]:
+                prefixes.setdefault(normalized[line], []).append(line)
+
+        qs = tokens.prefix_many(list(prefixes))
+        if type:
+            qs = qs.filter(entity__type_id=type_id)
+
+        for token, entity_id in qs.values_list("token", "entity"):
+            for i in range(1, len(token) + 1):
+                for line in prefixes.get(token[:i], ()):
+                    resolved[line].add(entity_id)
+
+    def by_ids(self, ids):
+        return self.filter(id__in=ids).select_related(*self.search_select_related)
+
+    def advanced_search(self, bits, type=None):
+        resolved = self.resolve(bits, type)
+        return self.by_ids({i for ids in resolved.values() for i in ids})
 
     def countries(self):
+        # Evaluated lazily: forms build their querysets from this at import
         return self.filter(type__abbr="co").select_related(
             *self.select_related_by_type["co"]
         )
@@ -123,18 +192,77 @@ class TravelEntityManager(Manager):
         return dict([(e.code, e) for e in self.countries()])
 
     def find(self, abbr, code, aux):
+        type_id = travel_registry.entity_types.pk_for(abbr)
         if aux:
-            qs = self.filter(type__abbr=abbr, country__code=code, code=aux)
+            qs = self.filter(type_id=type_id, country__code=code, code=aux)
         else:
-            qs = self.filter(type__abbr=abbr, code=code)
+            qs = self.filter(type_id=type_id, code=code)
 
         return qs.select_related(
             *self.select_related_by_type.get(abbr, self.base_select_related)
         )
 
+    # More than the depth of the state and country hierarchy
+    max_timezone_rounds = 5
+
+    def refresh_timezones(self, entity_ids=None):
+        """
+        Recompute ``effective_tz`` for ``entity_ids`` (all entities if None)
+        and write the ones that changed, bypassing ``save``. Since ``save``
+        does not run, changes are carried on to the descendants of changed
+        entities here, until nothing changes. Returns the number of entities
+        updated.
+        """
+        count = 0
+        for _ in range(self.max_timezone_rounds):
+            changed = self._refresh_timezones(entity_ids)
+            count += len(changed)
+            if entity_ids is None or not changed:
+                break
+
+            entity_ids = set(
+                self.filter(
+                    ancestor_links__ancestor__in=changed,
+                    ancestor_links__via__in=self.model.TIMEZONE_VIA,
+                ).values_list("id", flat=True)
+            )
+
+        return count
+
+    def _refresh_timezones(self, entity_ids):
+        qs = self.all() if entity_ids is None else self.filter(id__in=entity_ids)
+        rows, current = {}, {}
+        for pk, tz, state, country, effective_tz in qs.values_list(
+            "id", "tz", "state", "country", "effective_tz"
+        ):
+            rows[pk] = (tz, state, country)
+            current[pk] = effective_tz
+
+        outside = {ref for _, *refs in rows.values() for ref in refs if ref}
+        outside -= rows.keys()
+        known = dict(self.filter(id__in=outside).values_list("id", "effective_tz"))
+        changed = [
+            self.model(id=pk, effective_tz=tz)
+            for pk, tz in travel_utils.resolve_timezones(rows, known).items()
+            if tz != current[pk]
+        ]
+        self.bulk_update(changed, ["effective_tz"], batch_size=1000)
+        return [entity.id for entity in changed]
+
+    def type_count(self, entity_type):
+        """
+        Number of entities of ``entity_type``, cached until any entity is saved
+        or deleted.
+        """
+        return caching.get_or_set(
+            caching.versioned_key("entity-count", entity_type.pk),
+            lambda: self.filter(type=entity_type).count(),
+        )
+
     def type_related(self, ref, qs=None):
         ref_abbr = ref if isinstance(ref, str) else ref.abbr
-        qs = qs or self.filter(type__abbr=ref_abbr)
+        if qs is None:
+            qs = self.filter(type_id=travel_registry.entity_types.pk_for(ref_abbr))
 
         related = self.select_related_by_type.get(ref_abbr, self.base_select_related)
         qs = qs.select_related(*related)
@@ -146,10 +274,295 @@ class TravelEntityManager(Manager):
 
 class TravelLogManager(Manager):
 
+    @staticmethod
+    def _checklist_key(user_id):
+        return caching.make_key("checklist", user_id)
+
+    def cached_checklist(self, user):
+        """
+        The set of entity ids ``user`` has logged, kept in the cache until one
+        of their logs is saved or deleted.
+        """
+        return caching.get_or_set(
+            self._checklist_key(user.pk),
+            lambda: frozenset(
+                self.filter(user=user).order_by().values_list("entity", flat=True)
+            ),
+        )
+
+    def clear_checklist(self, user_id):
+        caching.delete(self._checklist_key(user_id))
+
     def checklist(self, user):
         return dict(
             self.filter(user=user)
-            .order_by("-arrival")
+            .order_by()
             .values_list("entity")
             .annotate(count=Count("entity"))
         )
+
+
+class TravelSearchTokenManager(Manager):
+    batch_size = 1000
+
+    @staticmethod
+    def _prefix_q(token):
+        # The range lets SQLite walk the ``token`` index, which it cannot do for
+        # a LIKE; ``startswith`` keeps the match exact under any collation.
+        return Q(token__gte=token, token__lt=token + "\U0010ffff", token__startswith=token)
+
+    def prefix(self, term):
+        token = travel_utils.normalize_search_text(term)
+        if not token:
+            return self.none()
+
+        return self.filter(self._prefix_q(token))
+
+    def prefix_many(self, tokens):
+        if not tokens:
+            return self.none()
+
+        return self.filter(reduce(operator.or_, [self._prefix_q(t) for t in tokens]))
+
+    def _entity_values(self, entity_ids):
+        entity_model = self.model._meta.get_field("entity").related_model
+        alias_model = entity_model._meta.get_field("travelalias").related_model
+        entities = entity_model.objects.order_by()
+        aliases = alias_model.objects.order_by()
+        if entity_ids is not None:
+            entities = entities.filter(id__in=entity_ids)
+            aliases = aliases.filter(entity__in=entity_ids)
+
+        values = {}
+        for row in entities.values_list(
+            "id", "name", "full_name", "locality", "code", "alt_code"
+        ).iterator():
+            values[row[0]] = list(row[1:])
+
+        for entity_id, alias in aliases.values_list("entity", "alias").iterator():
+            values[entity_id].append(alias)
+
+        return values
+
+    def _iter_tokens(self, values):
+        for entity_id, texts in values.items():
+            tokens = {}
+            for text in texts:
+                for i, token in enumerate(travel_utils.search_tokens(text)):
+                    tokens[token] = tokens.get(token, False) or i == 0
+
+            for token, is_complete in tokens.items():
+                yield self.model(
+                    entity_id=entity_id, token=token[:255], is_complete=is_complete
+                )
+
+    def rebuild(self, entity_ids=None):
+        """
+        Regenerate the tokens of the given entities, or of all entities when
+        ``entity_ids`` is ``None``. Returns the number of tokens written.
+        """
+        existing = self.all() if entity_ids is None else self.filter(entity__in=entity_ids)
+        existing.delete()
+
+        count = 0
+        tokens = self._iter_tokens(self._entity_values(entity_ids))
+        while batch := list(islice(tokens, self.batch_size)):
+            self.bulk_create(batch)
+            count += len(batch)
+
+        return count
+
+
+class TravelEntityClosureManager(Manager):
+    ancestor_fields = ("state", "country", "continent", "country__continent")
+    batch_size = 1000
+
+    def _iter_rows(self, entity_ids):
+        entities = self.model._meta.get_field("descendant").related_model.objects.order_by()
+        if entity_ids is not None:
+            entities = entities.filter(id__in=entity_ids)
+
+        for entity_id, type_id, *ancestors in entities.values_list(
+            "id", "type", *self.ancestor_fields
+        ).iterator():
+            for via, ancestor_id in zip(self.ancestor_fields, ancestors):
+                if ancestor_id is not None and ancestor_id != entity_id:
+                    yield self.model(
+                        ancestor_id=ancestor_id,
+                        descendant_id=entity_id,
+                        descendant_type_id=type_id,
+                        via=via,
+                    )
+
+    def rebuild(self, entity_ids=None):
+        """
+        Regenerate the ancestor rows of the given entities, or of all entities
+        when ``entity_ids`` is ``None``. Returns the number of rows written.
+        """
+        existing = (
+            self.all() if entity_ids is None else self.filter(descendant__in=entity_ids)
+        )
+        existing.delete()
+
+        count = 0
+        rows = self._iter_rows(entity_ids)
+        while batch := list(islice(rows, self.batch_size)):
+            self.bulk_create(batch)
+            count += len(batch)
+
+        return count
+
+    def _links(self, entity):
+        return set(
+            self.filter(descendant=entity).values_list(
+                "ancestor", "descendant_type", "via"
+            )
+        )
+
+    def sync(self, entity):
+        """
+        Refresh the rows of a saved ``entity``. When its own ancestors changed,
+        the rows of its descendants (which may reach a continent through it)
+        are refreshed too. Returns the ids of ancestors gained or lost.
+        """
+        before = self._links(entity)
+        self.rebuild([entity.pk])
+        after = self._links(entity)
+        if before == after:
+            return set()
+
+        descendants = list(
+            self.filter(ancestor=entity).values_list("descendant", flat=True)
+        )
+        if descendants:
+            self.rebuild(descendants)
+
+        return {link[0] for link in before ^ after}
+
+    def relationship_counts(self, abbr, via):
+        """
+        ``(type abbr, count)`` pairs of descendants linked through ``via`` for
+        every entity of type ``abbr``, as a dict keyed by entity id. Each type
+        is counted only through the path its listing pages over.
+        """
+        entity_model = self.model._meta.get_field("ancestor").related_model
+        entity_types = travel_registry.entity_types
+        type_id = entity_types.pk_for(abbr)
+        counts = {
+            entity_id: []
+            for entity_id in entity_model.objects.filter(type_id=type_id).values_list(
+                "id", flat=True
+            )
+        }
+        for ancestor_id, descendant_type, link, count in (
+            self.filter(ancestor__type_id=type_id, via__in=via)
+            .order_by("ancestor", "descendant_type", "via")
+            .values_list("ancestor", "descendant_type", "via")
+            .annotate(cnt=Count("descendant", distinct=True))
+        ):
+            type_abbr = entity_types.get(descendant_type).abbr
+            if link == entity_model.Related.via_for(abbr, type_abbr):
+                counts[ancestor_id].append((type_abbr, count))
+
+        return counts
+
+
+class TravelLogHistoryManager(Manager):
+    """
+    Keeps one pre-rendered copy of the profile history API payload per user,
+    patched in place as logs change instead of re-serialized on each request.
+    """
+
+    @staticmethod
+    def _serializers():
+        # The API serializers import the models, so defer the import
+        from .api import serializers
+
+        return serializers
+
+    @staticmethod
+    def _render(payload):
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        return data, '"{}"'.format(hashlib.md5(data.encode()).hexdigest())
+
+    # The orders ``rebuild`` gets from the database, so that a patched payload
+    # stays identical to a rebuilt one
+    LOG_ORDERING = ("-arrival", "-id")
+    ENTITY_ORDERING = ("name", "id")
+
+    @staticmethod
+    def _log_order(item):
+        return datetime.fromisoformat(item["arrival"]), item["id"]
+
+    @staticmethod
+    def _entity_order(item):
+        return item["name"], item["id"]
+
+    def for_user(self, user):
+        try:
+            return self.get(user=user)
+        except self.model.DoesNotExist:
+            return self.rebuild(user)
+
+    def rebuild(self, user):
+        serializers = self._serializers()
+        data, etag = self._render(serializers.TravelUserLogSerializer(user).data)
+        history, _ = self.update_or_create(
+            user=user, defaults={"data": data, "etag": etag}
+        )
+        return history
+
+    def _entity_data(self, entity_id):
+        serializers = self._serializers()
+        entity = (
+            serializers.TravelEntity.objects.filter(id=entity_id)
+            .select_related("country", "flag", "country__flag", "type")
+            .get()
+        )
+        return serializers.TravelEntitySerializer(entity).data
+
+    def apply(self, log, deleted=False):
+        """
+        Patch ``log`` into (or, if ``deleted``, out of) its user's payload.
+        Users whose payload has not been built yet are left alone; it will be
+        built in full on their next request.
+        """
+        with transaction.atomic():
+            history = self.select_for_update().filter(user_id=log.user_id).first()
+            if history is None:
+                return
+
+            payload = json.loads(history.data)
+            logs = [item for item in payload["logs"] if item["id"] != log.id]
+            if not deleted:
+                logs.append(self._serializers().TravelLogSerializer(log).data)
+
+            logs.sort(key=self._log_order, reverse=True)
+            entities = {item["id"]: item for item in payload["entities"]}
+            logged = {item["entity"] for item in logs}
+            for entity_id in logged - entities.keys():
+                entities[entity_id] = self._entity_data(entity_id)
+
+            payload["logs"] = logs
+            payload["entities"] = sorted(
+                [entities[entity_id] for entity_id in logged], key=self._entity_order
+            )
+            history.data, history.etag = self._render(payload)
+            history.save()
+
+    def clear_entities(self, entity_ids):
+        """
+        Drop the payloads that embed any of ``entity_ids``, to be rebuilt on
+        next request. Payloads embed the country of each logged entity, so
+        those with descendants of the entities are dropped too.
+        """
+        entity_ids = list(entity_ids)
+        if entity_ids:
+            logged = "user__travellog_set__entity"
+            self.filter(
+                Q(**{f"{logged}__in": entity_ids})
+                | Q(**{f"{logged}__ancestor_links__ancestor__in": entity_ids})
+            ).delete()
+
+    def clear_entity(self, entity):
+        self.clear_entities([entity.pk])
@@ -0,0 +1,181 @@
+"""
+A manifest of the travel images under ``MEDIA_ROOT`` (flags, maps and
+locators), so that pages can tell whether an image exists without a
+``stat()`` call per image.
+
+The manifest is a JSON list of paths relative to ``MEDIA_ROOT``. It is
+written by the ``build_media_manifest`` command to ``TRAVEL_MEDIA_MANIFEST``,
+which defaults to ``travel/manifest.json`` under ``MEDIA_ROOT``. Saving a flag
+with an SVG adds that file to the manifest.
+
+Each process keeps the manifest in memory as a set. Like the registries, it
+reloads the set when the manifest's cache version is bumped. Lookups check
+the version at most once every ``CHECK_INTERVAL`` seconds, so a page of
+hundreds of flags costs no more than one cache read. Without a manifest
+file, lookups fall back to checking the filesystem.
+
+Deleting a flag deletes its SVG and removes it from the manifest. Updates
+take a file lock, so concurrent uploads cannot drop each other's names.
+"""
+import abc
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import caching
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+MEDIA_DIR = "travel/img"
+VERSION_NAME = "media-manifest"
+CHECK_INTERVAL = 1.0
+
+# The version of a snapshot that has never been loaded
+_UNLOADED = object()
+
+
+def manifest_path():
+    return getattr(settings, "TRAVEL_MEDIA_MANIFEST", None) or os.path.join(
+        settings.MEDIA_ROOT, "travel", "manifest.json"
+    )
+
+
+def write_atomic(path, text):
+    """
+    Replace the file at ``path`` with ``text``, through a temporary file of
+    this writer's own so that readers never see a partial file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False
+    ) as fp:
+        fp.write(text)
+
+    os.chmod(fp.name, 0o644)
+    os.replace(fp.name, path)
+
+
+class JSONSnapshot(abc.ABC):
+    """
+    The contents of a JSON file, held in memory and reloaded once the cache
+    version ``version_name`` has been bumped. The version is checked at most
+    every ``CHECK_INTERVAL`` seconds, and without a cache version the file is
+    reread on each check. ``load`` returns None if the file does not exist.
+    """
+
+    version_name = None
+
+    def __init__(self):
+        self._snapshot = (_UNLOADED, None)
+        self._checked = 0.0
+
+    @abc.abstractmethod
+    def path(self):
+        """The path of the JSON file."""
+
+    def parse(self, data):
+        return data
+
+    def _read(self):
+        try:
+            with open(self.path()) as fp:
+                return self.parse(json.load(fp))
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        now = time.monotonic()
+        if now - self._checked >= CHECK_INTERVAL:
+            self._checked = now
+            version = caching.get_version(self.version_name)
+            if version is None or self._snapshot[0] != version:
+                self._snapshot = (version, self._read())
+
+        return self._snapshot[1]
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold an exclusive lock on the file, for read-modify-write updates.
+        """
+        path = self.path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.lock", "a") as fp:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            yield
+
+    def write(self, data):
+        write_atomic(self.path(), json.dumps(data, indent=0))
+        self.clear()
+
+    def clear(self):
+        caching.bump_version(self.version_name)
+        self._checked = 0.0
+
+
+class MediaManifest(JSONSnapshot):
+    version_name = VERSION_NAME
+
+    def path(self):
+        return manifest_path()
+
+    def parse(self, data):
+        return frozenset(data)
+
+    def names(self):
+        return self.load()
+
+    def exists(self, name):
+        names = self.load()
+        if names is None:
+            return os.path.exists(os.path.join(settings.MEDIA_ROOT, name))
+
+        return name in names
+
+    def scan(self):
+        root = os.path.join(settings.MEDIA_ROOT, MEDIA_DIR)
+        for dirpath, _, filenames in os.walk(root):
+            relative = os.path.relpath(dirpath, settings.MEDIA_ROOT or ".")
+            for filename in filenames:
+                yield os.path.join(relative, filename).replace(os.sep, "/")
+
+    def rebuild(self):
+        """
+        Record every file under ``MEDIA_DIR``. Returns the number of files.
+        """
+        with self.locked():
+            names = set(self.scan())
+            self.write(sorted(names))
+
+        return len(names)
+
+    def update(self, add=(), discard=()):
+        if not os.path.exists(self.path()):
+            return
+
+        with self.locked():
+            current = self._read()
+            if current is None:
+                return
+
+            names = current.union(add).difference(discard)
+            if names != current:
+                self.write(sorted(names))
+
+    def add(self, *names):
+        self.update(add=names)
+
+    def discard(self, *names):
+        self.update(discard=names)
+
+
+media_manifest = MediaManifest()
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from travel import search
+
+    backend = search.get_backend()
+    backend.install()
+    backend.rebuild()
+
+
+def uninstall_search_index(apps, schema_editor):
+    from travel import search
+
+    search.get_backend().uninstall()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0010_travelentityinfo_intregion_travelentityinfo_region_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0011_entity_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TravelSearchToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("token", models.CharField(db_index=True, max_length=255)),
+                (
+                    "entity",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_tokens",
+                        to="travel.travelentity",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "search tokens",
+                "db_table": "travel_search_token",
+            },
+        ),
+    ]
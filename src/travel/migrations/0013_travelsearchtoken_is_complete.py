@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0012_travelsearchtoken"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="travelsearchtoken",
+            name="is_complete",
+            field=models.BooleanField(default=False),
+        ),
+    ]
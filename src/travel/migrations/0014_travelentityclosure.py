@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+ANCESTOR_FIELDS = ("state", "country", "continent", "country__continent")
+
+
+def populate_closure(apps, schema_editor):
+    TravelEntity = apps.get_model("travel", "TravelEntity")
+    TravelEntityClosure = apps.get_model("travel", "TravelEntityClosure")
+    rows = []
+    for entity_id, type_id, *ancestors in TravelEntity.objects.values_list(
+        "id", "type", *ANCESTOR_FIELDS
+    ).iterator():
+        rows.extend(
+            TravelEntityClosure(
+                ancestor_id=ancestor_id,
+                descendant_id=entity_id,
+                descendant_type_id=type_id,
+                via=via,
+            )
+            for via, ancestor_id in zip(ANCESTOR_FIELDS, ancestors)
+            if ancestor_id is not None and ancestor_id != entity_id
+        )
+
+    TravelEntityClosure.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0013_travelsearchtoken_is_complete"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TravelEntityClosure",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("via", models.CharField(max_length=20)),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_links",
+                        to="travel.travelentity",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_links",
+                        to="travel.travelentity",
+                    ),
+                ),
+                (
+                    "descendant_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="travel.travelentitytype",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "entity closure",
+                "db_table": "travel_entity_closure",
+                "indexes": [
+                    models.Index(
+                        fields=["ancestor", "via", "descendant_type"],
+                        name="travel_enti_ancesto_de9fdf_idx",
+                    )
+                ],
+                "unique_together": {("ancestor", "descendant", "via")},
+            },
+        ),
+        migrations.RunPython(populate_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0014_travelentityclosure"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="travelentity",
+            index=models.Index(
+                fields=["type", "name", "id"], name="travel_enti_type_id_a30c02_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("travel", "0015_travelentity_type_name_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TravelLogHistory",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="travel_history",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("data", models.TextField()),
+                ("etag", models.CharField(max_length=34)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "log histories",
+                "db_table": "travel_log_history",
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+def populate_effective_tz(apps, schema_editor):
+    # A frozen copy of travel.utils.resolve_timezones at the time of writing
+    TravelEntity = apps.get_model("travel", "TravelEntity")
+    rows = {
+        pk: (tz, state, country)
+        for pk, tz, state, country in TravelEntity.objects.values_list(
+            "id", "tz", "state", "country"
+        ).iterator()
+    }
+    resolved = {}
+    pending = set()
+
+    def resolve(pk):
+        if pk in resolved:
+            return resolved[pk]
+        if pk not in rows or pk in pending:
+            return ""
+
+        pending.add(pk)
+        tz, state, country = rows[pk]
+        resolved[pk] = (
+            tz or (state and resolve(state)) or (country and resolve(country)) or "UTC"
+        )
+        return resolved[pk]
+
+    TravelEntity.objects.bulk_update(
+        [TravelEntity(id=pk, effective_tz=resolve(pk)) for pk in rows],
+        ["effective_tz"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0016_traveloghistory"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="travelentity",
+            name="effective_tz",
+            field=models.CharField(
+                blank=True, editable=False, max_length=40, verbose_name="effective timezone"
+            ),
+        ),
+        migrations.RunPython(populate_effective_tz, migrations.RunPython.noop),
+    ]
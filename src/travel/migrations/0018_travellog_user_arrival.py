@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0017_travelentity_effective_tz"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="travellog",
+            index=models.Index(fields=["user", "arrival"], name="travel_trav_user_id_9cbed5_idx"),
+        ),
+    ]
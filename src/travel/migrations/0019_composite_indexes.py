@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("travel", "0018_travellog_user_arrival"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="travelentity",
+            index=models.Index(fields=["type", "code"], name="travel_enti_type_id_ee7ef5_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="travelentity",
+            index=models.Index(
+                fields=["type", "country", "code"], name="travel_enti_type_id_45fec5_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="travellog",
+            index=models.Index(
+                fields=["user", "entity", "arrival"], name="travel_trav_user_id_ca8aee_idx"
+            ),
+        ),
+    ]
@@ -2,16 +2,20 @@ import os
 from collections import Counter
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.functional import cached_property
 
-from dateutil.tz import gettz
 import travel.utils as travel_utils
+import travel.search as travel_search
+from . import caching
 from . import managers
+from . import registry as travel_registry
+from .manifest import media_manifest
+from .sprites import flag_sprite
 
 GOOGLE_MAPS = "http://maps.google.com/maps?q={}"
 GOOGLE_MAPS_LATLON = "http://maps.google.com/maps?q={},+{}&iwloc=A&z=10"
@@ -37,7 +41,7 @@ class TravelFlag(models.Model):
 
     @cached_property
     def image_url(self):
-        if self.svg and os.path.exists(self.svg.path):
+        if self.svg and media_manifest.exists(self.svg.name):
             return self.svg.url
 
         return self.source
@@ -47,6 +51,83 @@ class TravelFlag(models.Model):
         return self.image_url
 
 
+def add_flag_to_manifest(sender, instance, raw=False, **kws):
+    name = instance.svg.name
+    if raw or not name or media_manifest.exists(name):
+        return
+
+    if instance.svg.storage.exists(name):
+        media_manifest.add(name)
+
+
+def discard_flag_from_manifest(sender, instance, **kws):
+    name = instance.svg.name
+    if name and not TravelFlag.objects.filter(svg=name).exists():
+        transaction.on_commit(lambda: media_manifest.discard(name))
+
+
+def refresh_flag_sprite(sender, instance, raw=False, **kws):
+    if not raw:
+        flag_sprite.refresh(instance)
+
+
+# The fields the flag game payload and round index are built from
+FLAG_GAME_FIELDS = {
+    "TravelFlag": ("svg",),
+    "TravelEntity": ("type", "code", "name", "flag"),
+    "TravelEntityInfo": ("entity", "region", "subregion"),
+}
+
+
+def _flag_game_values(instance):
+    opts = instance._meta
+    return tuple(
+        opts.get_field(name).value_from_object(instance)
+        for name in FLAG_GAME_FIELDS[opts.object_name]
+    )
+
+
+def _is_country(type_id):
+    return type_id == travel_registry.entity_types.pk_for("co")
+
+
+def check_flag_game(sender, instance, raw=False, **kws):
+    """
+    Note whether saving ``instance`` changes what the flag game shows: only
+    countries are in the game, and only through ``FLAG_GAME_FIELDS``.
+    """
+    fields = FLAG_GAME_FIELDS[sender.__name__]
+    old = None
+    if instance.pk is not None:
+        old = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+
+    changed = old != _flag_game_values(instance)
+    if changed and sender is TravelEntity:
+        changed = _is_country(instance.type_id) or bool(old and _is_country(old[0]))
+    elif changed and sender is TravelEntityInfo:
+        changed = _is_country(instance.entity.type_id)
+
+    instance._flag_game_changed = changed
+
+
+def clear_changed_flag_game(sender, instance, **kws):
+    if getattr(instance, "_flag_game_changed", True):
+        caching.bump_version("flag-game")
+
+
+def clear_flag_game(sender, instance, **kws):
+    if sender is not TravelEntity or _is_country(instance.type_id):
+        caching.bump_version("flag-game")
+
+
+models.signals.post_save.connect(add_flag_to_manifest, sender=TravelFlag)
+models.signals.post_delete.connect(discard_flag_from_manifest, sender=TravelFlag)
+models.signals.post_save.connect(refresh_flag_sprite, sender=TravelFlag)
+models.signals.pre_save.connect(check_flag_game, sender=TravelFlag)
+models.signals.post_save.connect(clear_changed_flag_game, sender=TravelFlag)
+models.signals.post_delete.connect(clear_flag_game, sender=TravelFlag)
+
+
 class TravelBucketList(models.Model):
     owner = models.ForeignKey(
         User, blank=True, null=True, default=None, on_delete=models.CASCADE
@@ -141,6 +222,14 @@ class TravelEntityType(models.Model):
         return self.title
 
 
+def clear_registry(sender, **kws):
+    travel_registry.get_registry(sender).clear()
+
+
+models.signals.post_save.connect(clear_registry, sender=TravelEntityType)
+models.signals.post_delete.connect(clear_registry, sender=TravelEntityType)
+
+
 class TravelClassification(models.Model):
     type = models.ForeignKey(TravelEntityType, on_delete=models.CASCADE)
     title = models.CharField(max_length=30)
@@ -152,6 +241,10 @@ class TravelClassification(models.Model):
         return self.title
 
 
+models.signals.post_save.connect(clear_registry, sender=TravelClassification)
+models.signals.post_delete.connect(clear_registry, sender=TravelClassification)
+
+
 class Extern(object):
 
     def __init__(self, name, handler, entity):
@@ -228,18 +321,34 @@ class TravelEntity(models.Model):
     )
 
     tz = models.CharField("timezone", max_length=40, blank=True)
+    effective_tz = models.CharField(
+        "effective timezone", max_length=40, blank=True, editable=False
+    )
     updated = models.DateTimeField(auto_now=True)
     description = models.TextField(default="", blank=True)
 
     objects = managers.TravelEntityManager()
 
+    # Closure links through which descendants inherit a timezone
+    TIMEZONE_VIA = ("state", "country")
+
     class Meta:
         ordering = ("name",)
         db_table = "travel_entity"
         verbose_name_plural = "entities"
+        indexes = [
+            models.Index(fields=["type", "name", "id"]),
+            # ``TravelEntityManager.find``
+            models.Index(fields=["type", "code"]),
+            models.Index(fields=["type", "country", "code"]),
+        ]
 
     class Related:
-        ENTITY_TYPES = {"co": "entity_set__country", "st": "entity_set__state"}
+        ENTITY_TYPES = {
+            "co": ["country"],
+            "st": ["state"],
+            "cn": ["continent", "country__continent"],
+        }
         DETAILS = {
             "co": "Countries",
             "st": "States, provinces, territories, etc",
@@ -255,6 +364,18 @@ class TravelEntity(models.Model):
             "cn": {"co": "continent", "default": "country__continent"},
         }
 
+        @classmethod
+        def via_for(cls, abbr, type_abbr):
+            """
+            The closure path linking an entity of type ``abbr`` to the
+            descendants of type ``type_abbr`` listed for it.
+            """
+            via = cls.BY_TYPE_PARAMS[abbr]
+            if isinstance(via, dict):
+                via = via.get(type_abbr, via["default"])
+
+            return via
+
     def __str__(self):
         return self.name
 
@@ -291,8 +412,8 @@ class TravelEntity(models.Model):
     @cached_property
     def get_entityinfo(self):
         try:
-            return (
-                TravelEntityInfo.objects.select_related("currency", "entity")
+            info = (
+                TravelEntityInfo.objects.select_related("entity")
                 .prefetch_related(
                     "languages",
                     "neighbors",
@@ -302,15 +423,19 @@ class TravelEntity(models.Model):
         except TravelEntityInfo.DoesNotExist:
             return None
 
+        if info.currency_id:
+            info.currency = travel_registry.currencies.get(info.currency_id)
+
+        return info
+
     @cached_property
     def category_detail(self):
-        if self.classification:
-            return self.classification.title
+        if self.classification_id:
+            return travel_registry.classifications.get(self.classification_id).title
 
         return self.type.title
 
-    @cached_property
-    def timezone(self):
+    def resolve_timezone(self):
         return (
             self.tz
             or (self.state and self.state.timezone)
@@ -318,9 +443,24 @@ class TravelEntity(models.Model):
             or "UTC"
         )
 
+    @cached_property
+    def timezone(self):
+        return self.effective_tz or self.resolve_timezone()
+
     @property
     def tzinfo(self):
-        return gettz(self.timezone)
+        return travel_utils.get_tzinfo(self.timezone)
+
+    def save(self, *args, **kws):
+        effective_tz = self.resolve_timezone()
+        self._effective_tz_changed = effective_tz != self.effective_tz
+        self.effective_tz = effective_tz
+        self.__dict__.pop("timezone", None)
+        update_fields = kws.get("update_fields")
+        if update_fields is not None and self._effective_tz_changed:
+            kws["update_fields"] = {*update_fields, "effective_tz"}
+
+        return super().save(*args, **kws)
 
     def get_continent(self):
         if self.continent:
@@ -329,22 +469,54 @@ class TravelEntity(models.Model):
 
     @property
     def relationships(self):
+        """
+        ``(type abbr, count)`` pairs of the descendants that
+        ``related_by_type`` lists for each type.
+        """
         abbr = self.type.abbr
-        qs = None
-        if abbr == "cn":
-            qs = TravelEntityType.objects.distinct().filter(
-                models.Q(entity_set__continent=self)  # noqa
-                | models.Q(entity_set__country__continent=self)
+        via = self.Related.ENTITY_TYPES.get(abbr)
+        if via is None:
+            return ()
+
+        entity_types = travel_registry.entity_types
+        counts = []
+        for descendant_type, link, count in (
+            TravelEntityClosure.objects.filter(ancestor=self, via__in=via)
+            .order_by("descendant_type", "via")
+            .values_list("descendant_type", "via")
+            .annotate(cnt=models.Count("descendant", distinct=True))
+        ):
+            type_abbr = entity_types.get(descendant_type).abbr
+            if link == self.Related.via_for(abbr, type_abbr):
+                counts.append((type_abbr, count))
+
+        return counts
+
+    @staticmethod
+    def _relationships_key(entity_id):
+        return caching.versioned_key("relationships", entity_id)
+
+    @classmethod
+    def clear_relationships(cls, entity_ids):
+        caching.delete_many([cls._relationships_key(i) for i in entity_ids])
+
+    @classmethod
+    def warm_relationships(cls, abbrs=("co", "cn")):
+        counts = {}
+        for abbr in abbrs:
+            counts.update(
+                TravelEntityClosure.objects.relationship_counts(
+                    abbr, cls.Related.ENTITY_TYPES[abbr]
+                )
             )
-        else:
-            key = self.Related.ENTITY_TYPES.get(abbr)
-            if key:
-                qs = TravelEntityType.objects.distinct().filter(**{key: self})
 
-        return (
-            ()
-            if qs is None
-            else qs.annotate(cnt=models.Count("abbr")).values_list("abbr", "cnt")
+        caching.set_many({cls._relationships_key(i): c for i, c in counts.items()})
+        return len(counts)
+
+    @cached_property
+    def cached_relationships(self):
+        return caching.get_or_set(
+            self._relationships_key(self.pk), lambda: list(self.relationships)
         )
 
     @cached_property
@@ -359,7 +531,7 @@ class TravelEntity(models.Model):
                     args=[self.type.abbr, self.code_url_bit, abbr],
                 ),
             }
-            for abbr, cnt in self.relationships
+            for abbr, cnt in self.cached_relationships
         ]
 
     @property
@@ -372,11 +544,10 @@ class TravelEntity(models.Model):
         return ""
 
     def related_by_type(self, type):
-        key = self.Related.BY_TYPE_PARAMS[self.type.abbr]
-        if isinstance(key, dict):
-            key = key.get(type.abbr, key["default"])
-
-        qs = TravelEntity.objects.filter(**{key: self, "type": type})
+        via = self.Related.via_for(self.type.abbr, type.abbr)
+        qs = TravelEntity.objects.filter(
+            ancestor_links__ancestor=self, ancestor_links__via=via, type=type
+        )
         return TravelEntity.objects.type_related(type, qs)
 
     def update_flag(self, flag_url):
@@ -409,6 +580,93 @@ class TravelEntity(models.Model):
             )
 
 
+def update_search_index(sender, instance, **kws):
+    travel_search.get_backend().update([instance.pk])
+
+
+def remove_search_index(sender, instance, **kws):
+    travel_search.get_backend().remove([instance.pk])
+
+
+def clear_type_counts(sender, instance, **kws):
+    caching.bump_version("entity-count")
+
+
+models.signals.post_save.connect(update_search_index, sender=TravelEntity)
+models.signals.post_delete.connect(remove_search_index, sender=TravelEntity)
+models.signals.post_save.connect(clear_type_counts, sender=TravelEntity)
+models.signals.post_delete.connect(clear_type_counts, sender=TravelEntity)
+models.signals.pre_save.connect(check_flag_game, sender=TravelEntity)
+models.signals.post_save.connect(clear_changed_flag_game, sender=TravelEntity)
+models.signals.post_delete.connect(clear_flag_game, sender=TravelEntity)
+
+
+class TravelEntityClosure(models.Model):
+    """
+    One row for each of an entity's ``state``, ``country``, ``continent`` and
+    ``country.continent``, recording which of those paths (``via``) links it.
+    """
+
+    ancestor = models.ForeignKey(
+        TravelEntity, related_name="descendant_links", on_delete=models.CASCADE
+    )
+    descendant = models.ForeignKey(
+        TravelEntity, related_name="ancestor_links", on_delete=models.CASCADE
+    )
+    descendant_type = models.ForeignKey(
+        TravelEntityType, related_name="+", on_delete=models.CASCADE
+    )
+    via = models.CharField(max_length=20)
+
+    objects = managers.TravelEntityClosureManager()
+
+    class Meta:
+        db_table = "travel_entity_closure"
+        verbose_name_plural = "entity closure"
+        unique_together = [("ancestor", "descendant", "via")]
+        indexes = [models.Index(fields=["ancestor", "via", "descendant_type"])]
+
+
+def sync_entity_closure(sender, instance, raw=False, **kws):
+    if not raw:
+        TravelEntity.clear_relationships(TravelEntityClosure.objects.sync(instance))
+
+
+def detach_entity_closure(sender, instance, **kws):
+    # Descendants are about to lose their FK to this entity (SET_NULL), which
+    # bypasses save(); remember them so their rows can be rebuilt afterwards.
+    instance._closure_descendants = list(
+        instance.descendant_links.values_list("descendant", flat=True)
+    )
+    instance._closure_ancestors = list(
+        instance.ancestor_links.values_list("ancestor", flat=True)
+    )
+
+
+def rebuild_detached_closure(sender, instance, **kws):
+    descendants = getattr(instance, "_closure_descendants", None)
+    if descendants:
+        TravelEntityClosure.objects.rebuild(descendants)
+        TravelEntity.objects.refresh_timezones(descendants)
+
+    TravelEntity.clear_relationships(getattr(instance, "_closure_ancestors", []))
+
+
+def propagate_timezone(sender, instance, raw=False, **kws):
+    if not raw and getattr(instance, "_effective_tz_changed", False):
+        TravelEntity.objects.refresh_timezones(
+            instance.descendant_links.filter(
+                via__in=TravelEntity.TIMEZONE_VIA
+            ).values_list("descendant", flat=True)
+        )
+
+
+models.signals.post_save.connect(sync_entity_closure, sender=TravelEntity)
+models.signals.post_save.connect(propagate_timezone, sender=TravelEntity)
+models.signals.pre_delete.connect(detach_entity_closure, sender=TravelEntity)
+models.signals.post_delete.connect(rebuild_detached_closure, sender=TravelEntity)
+
+
 class ExternalSource(models.Model):
     name = models.CharField(max_length=50, unique=True)
     url = models.URLField(blank=True)
@@ -439,6 +697,36 @@ class TravelAlias(models.Model):
         verbose_name_plural = "aliases"
 
 
+class TravelSearchToken(models.Model):
+    entity = models.ForeignKey(
+        TravelEntity, related_name="search_tokens", on_delete=models.CASCADE
+    )
+    token = models.CharField(max_length=255, db_index=True)
+    is_complete = models.BooleanField(default=False)
+
+    objects = managers.TravelSearchTokenManager()
+
+    class Meta:
+        db_table = "travel_search_token"
+        verbose_name_plural = "search tokens"
+
+    def __str__(self):
+        return self.token
+
+
+def update_search_tokens(sender, instance, **kws):
+    TravelSearchToken.objects.rebuild([instance.pk])
+
+
+def update_alias_search_tokens(sender, instance, **kws):
+    TravelSearchToken.objects.rebuild([instance.entity_id])
+
+
+models.signals.post_save.connect(update_search_tokens, sender=TravelEntity)
+models.signals.post_save.connect(update_alias_search_tokens, sender=TravelAlias)
+models.signals.post_delete.connect(update_alias_search_tokens, sender=TravelAlias)
+
+
 class TravelLog(models.Model):
 
     RATING_CHOICES = (
@@ -463,6 +751,11 @@ class TravelLog(models.Model):
         get_latest_by = "arrival"
         ordering = ("-arrival",)
         verbose_name_plural = "logs"
+        indexes = [
+            models.Index(fields=["user", "arrival"]),
+            # A user's logs for one entity, and the checklist's GROUP BY entity
+            models.Index(fields=["user", "entity", "arrival"]),
+        ]
 
     def __str__(self):
         return "{} | {}".format(self.entity, self.user)
@@ -507,9 +800,79 @@ class TravelLog(models.Model):
         )
 
     @classmethod
-    def history_json(cls, user):
+    def iter_history_json(cls, user, asynchronous=False):
         entities, logs = cls.user_history(user)
-        return travel_utils.json_dumps({"entities": list(entities), "logs": list(logs)})
+        iter_json = travel_utils.aiter_json if asynchronous else travel_utils.iter_json
+        return iter_json({"entities": entities, "logs": logs})
+
+    @classmethod
+    def history_json(cls, user, compact=False):
+        if compact:
+            entities, logs = cls.user_history(user)
+            return travel_utils.json_dumps(
+                {"entities": list(entities), "logs": list(logs)}, compact=True
+            )
+
+        return "".join(cls.iter_history_json(user))
+
+
+def clear_checklist(sender, instance, **kws):
+    TravelLog.objects.clear_checklist(instance.user_id)
+
+
+models.signals.post_save.connect(clear_checklist, sender=TravelLog)
+models.signals.post_delete.connect(clear_checklist, sender=TravelLog)
+
+
+class TravelLogHistory(models.Model):
+    """
+    The rendered profile history API payload for a user, with its ETag.
+    """
+
+    user = models.OneToOneField(
+        User, primary_key=True, related_name="travel_history", on_delete=models.CASCADE
+    )
+    data = models.TextField()
+    etag = models.CharField(max_length=34)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = managers.TravelLogHistoryManager()
+
+    class Meta:
+        db_table = "travel_log_history"
+        verbose_name_plural = "log histories"
+
+    def __str__(self):
+        return str(self.user)
+
+
+def update_log_history(sender, instance, raw=False, **kws):
+    if not raw:
+        TravelLogHistory.objects.apply(instance)
+
+
+def remove_log_history(sender, instance, **kws):
+    TravelLogHistory.objects.apply(instance, deleted=True)
+
+
+def clear_entity_log_history(sender, instance, raw=False, created=False, **kws):
+    if not (raw or created):
+        TravelLogHistory.objects.clear_entity(instance)
+
+
+def clear_flag_log_history(sender, instance, raw=False, created=False, **kws):
+    if not (raw or created):
+        TravelLogHistory.objects.clear_entities(
+            TravelEntity.objects.filter(flag=instance).values_list("pk", flat=True)
+        )
+
+
+models.signals.post_save.connect(update_log_history, sender=TravelLog)
+models.signals.post_delete.connect(remove_log_history, sender=TravelLog)
+models.signals.post_save.connect(clear_entity_log_history, sender=TravelEntity)
+models.signals.post_save.connect(clear_flag_log_history, sender=TravelFlag)
+# Before the delete, while entities still point at the flag
+models.signals.pre_delete.connect(clear_flag_log_history, sender=TravelFlag)
 
 
 class TravelLanguage(models.Model):
@@ -555,13 +918,18 @@ class TravelCurrency(models.Model):
         return self.name
 
 
+models.signals.post_save.connect(clear_registry, sender=TravelCurrency)
+models.signals.post_delete.connect(clear_registry, sender=TravelCurrency)
+
+
 class EntityImage(object):
 
     def __init__(self, entity, location):
         fn = entity.code.lower() + ".gif"
+        name = "/".join(["travel/img", location, fn])
         self.fqdn = os.path.join(settings.MEDIA_ROOT, "travel/img", location, fn)
-        self.exists = os.path.exists(self.fqdn)
-        self.url = settings.MEDIA_URL + "/".join(["travel/img", location, fn])
+        self.exists = media_manifest.exists(name)
+        self.url = settings.MEDIA_URL + name
 
 
 class Electrical(models.Model):
@@ -655,3 +1023,8 @@ class TravelEntityInfo(models.Model):
     def square_miles(self):
         if self.area is not None:
             return int(self.area * 0.386102)
+
+
+models.signals.pre_save.connect(check_flag_game, sender=TravelEntityInfo)
+models.signals.post_save.connect(clear_changed_flag_game, sender=TravelEntityInfo)
+models.signals.post_delete.connect(clear_flag_game, sender=TravelEntityInfo)
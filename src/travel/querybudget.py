@@ -0,0 +1,193 @@
+"""
+Per-request query budgets.
+
+A view declares the most queries one of its requests should need with a
+``query_budget`` class attribute. ``QueryBudgetMiddleware`` counts the queries
+of every request and logs those that go over their view's budget, with the
+SQL grouped by the line of code that issued it, so an N+1 pattern shows up as
+one call site with a large count. Tests check the same budgets with
+``assert_view_budget`` or ``assert_max_queries``.
+
+Queries run while a streaming response is consumed happen after the
+middleware returns and are not counted there; ``assert_view_budget`` consumes
+the stream and does count them.
+
+The middleware runs natively under both WSGI and ASGI. For async views, the
+recorder is installed on the connections of the thread that
+``sync_to_async`` runs the request's queries in.
+"""
+import logging
+import sys
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+# Frames from these packages are skipped when looking for a query's call site
+IGNORED_MODULES = ("django", "rest_framework", "vanilla", "contextlib", __name__)
+
+
+def _ignored(module):
+    return any(
+        module == name or module.startswith(name + ".") for name in IGNORED_MODULES
+    )
+
+
+def _template_site(frame):
+    if frame.f_code.co_name != "render_annotated":
+        return None
+
+    node = frame.f_locals.get("self")
+    origin = getattr(node, "origin", None)
+    token = getattr(node, "token", None)
+    if origin and token:
+        return f"{origin.template_name}:{token.lineno}"
+
+
+def call_site():
+    """
+    The innermost frame outside Django and the other ``IGNORED_MODULES``, as
+    ``module:line in function``, or the template line being rendered if that
+    comes first.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not _ignored(module):
+            return f"{module}:{frame.f_lineno} in {frame.f_code.co_name}"
+        if module == "django.template.base" and (site := _template_site(frame)):
+            return site
+        frame = frame.f_back
+
+    return "<unknown>"
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper that keeps the SQL and call site of every query.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, call_site()))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def by_site(self):
+        sites = defaultdict(list)
+        for sql, site in self.queries:
+            sites[site].append(sql)
+
+        return sorted(sites.items(), key=lambda item: -len(item[1]))
+
+    def report(self, sql_length=200):
+        lines = []
+        for site, statements in self.by_site():
+            lines.append(f"{len(statements):>4}x {site}")
+            lines.append(f"       {statements[0][:sql_length]}")
+
+        return "\n".join(lines)
+
+
+@contextmanager
+def record_queries(using=None):
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for alias in [using] if using else connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+
+def get_budget(view_func):
+    view_class = getattr(view_func, "view_class", None)
+    return getattr(view_class, "query_budget", None)
+
+
+class QueryBudgetMiddleware:
+    """
+    Logs a warning on the ``travel.querybudget`` logger for each request that
+    runs more queries than its view's ``query_budget``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        self.check(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recording = record_queries()
+        recorder = await sync_to_async(recording.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recording.__exit__)(None, None, None)
+
+        self.check(request, recorder)
+        return response
+
+    def check(self, request, recorder):
+        budget = getattr(request, "query_budget", None)
+        if budget is not None and len(recorder) > budget:
+            logger.warning(
+                "%s %s ran %d queries, over its budget of %d\n%s",
+                request.method,
+                request.path,
+                len(recorder),
+                budget,
+                recorder.report(),
+            )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_budget(view_func)
+
+
+@contextmanager
+def assert_max_queries(budget, using=None):
+    with record_queries(using) as recorder:
+        yield recorder
+
+    if len(recorder) > budget:
+        raise AssertionError(
+            f"{len(recorder)} queries, over the budget of {budget}\n"
+            f"{recorder.report()}"
+        )
+
+
+def assert_view_budget(client, url, **extra):
+    """
+    Request ``url`` with the test ``client`` and fail if it takes more queries
+    than the ``query_budget`` of the view it resolves to.
+    """
+    match = resolve(urlsplit(url).path)
+    budget = get_budget(match.func)
+    if budget is None:
+        raise AssertionError(f"{match.view_name} does not declare a query_budget")
+
+    with assert_max_queries(budget):
+        response = client.get(url, **extra)
+        if response.streaming:
+            response.streaming_content = [b"".join(response.streaming_content)]
+
+    return response
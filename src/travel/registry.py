@@ -0,0 +1,86 @@
+"""
+In-process snapshots of the small reference tables (entity types,
+classifications and currencies) that nearly every page reads but that only
+change through the admin.
+
+Each registry loads its whole table once per process and reuses it until the
+table's cache version is bumped, which happens whenever a row is saved or
+deleted and again when the transaction commits: the first bump lets the
+saving transaction see its own change, the second replaces any snapshot
+another process read before the commit. Checking the version is a single
+cache read, so every process picks up changes on its next lookup without
+touching the database in the meantime.
+
+The returned instances are shared between requests and must not be modified.
+"""
+from django.apps import apps
+from django.db import transaction
+
+from . import caching
+
+REGISTRIES = {}
+
+# The version of a registry that has never been loaded
+_UNLOADED = object()
+
+
+class Registry:
+
+    def __init__(self, model_name, lookup_field=None):
+        self.model_name = model_name
+        self.lookup_field = lookup_field
+        self.version_name = f"registry-{model_name.lower()}"
+        self._snapshot = (_UNLOADED, {}, {})
+        REGISTRIES[model_name] = self
+
+    @property
+    def model(self):
+        return apps.get_model("travel", self.model_name)
+
+    def _read(self, version):
+        by_pk = {obj.pk: obj for obj in self.model.objects.all()}
+        by_lookup = {}
+        if self.lookup_field:
+            by_lookup = {
+                getattr(obj, self.lookup_field): obj for obj in by_pk.values()
+            }
+
+        return (version, by_pk, by_lookup)
+
+    def _load(self):
+        version = caching.get_version(self.version_name)
+        if version is None:
+            # Without a working cache there is no way to tell when the table
+            # changes, so read it every time rather than keep a snapshot
+            return self._read(version)
+
+        if self._snapshot[0] != version:
+            self._snapshot = self._read(version)
+
+        return self._snapshot
+
+    def all(self):
+        return list(self._load()[1].values())
+
+    def get(self, pk):
+        return self._load()[1].get(pk)
+
+    def find(self, value):
+        return self._load()[2].get(value)
+
+    def pk_for(self, value):
+        obj = self.find(value)
+        return None if obj is None else obj.pk
+
+    def clear(self):
+        caching.bump_version(self.version_name)
+        transaction.on_commit(lambda: caching.bump_version(self.version_name))
+
+
+def get_registry(model):
+    return REGISTRIES[model.__name__]
+
+
+entity_types = Registry("TravelEntityType", "abbr")
+classifications = Registry("TravelClassification")
+currencies = Registry("TravelCurrency")
@@ -0,0 +1,203 @@
+"""
+Pluggable entity search backends.
+
+``TravelEntityManager.search`` and ``advanced_search`` ask the configured
+backend for a ``Q`` object matching a single term. The default backend performs
+the original ``icontains`` scans; the vendor backends keep an auxiliary index
+so the same matches can be found without reading every row of ``travel_entity``.
+
+Set ``TRAVEL_SEARCH_BACKEND`` to a dotted path to override the choice that is
+otherwise made from the database vendor.
+"""
+import operator
+from functools import reduce, lru_cache
+
+from django.conf import settings
+from django.db import connection, OperationalError
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+SEARCH_FIELDS = ("name", "full_name", "locality")
+ENTITY_TABLE = "travel_entity"
+
+VENDOR_BACKENDS = {
+    "sqlite": "travel.search.SQLiteSearchBackend",
+    "postgresql": "travel.search.PostgresSearchBackend",
+}
+
+
+class SearchBackend:
+    """
+    Case-insensitive substring match on the searchable columns, plus an exact
+    match on ``code``.
+    """
+
+    def q(self, term):
+        return reduce(
+            operator.or_, [Q(**{f"{field}__icontains": term}) for field in SEARCH_FIELDS]
+        ) | Q(code__iexact=term)
+
+    def q_many(self, terms):
+        return reduce(operator.or_, [self.q(term) for term in terms])
+
+    def install(self):
+        pass
+
+    def uninstall(self):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def update(self, ids):
+        pass
+
+    def remove(self, ids):
+        pass
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    Mirrors the searchable columns into an FTS5 table using the ``trigram``
+    tokenizer, which matches arbitrary case-insensitive substrings of three or
+    more characters. Shorter terms fall back to the default scan.
+    """
+
+    table = "travel_entity_fts"
+    min_length = 3
+
+    def __init__(self):
+        self._available = None
+
+    @property
+    def available(self):
+        if self._available is None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                    [self.table],
+                )
+                self._available = cursor.fetchone() is not None
+
+        return self._available
+
+    def _match(self, term):
+        return '{{{}}} : "{}"'.format(" ".join(SEARCH_FIELDS), term.replace('"', '""'))
+
+    def q(self, term):
+        if len(term) < self.min_length or not self.available:
+            return super().q(term)
+
+        return self._match_q([term]) | Q(code__iexact=term)
+
+    def _match_q(self, terms):
+        sql = f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s"
+        return Q(id__in=RawSQL(sql, [" OR ".join(self._match(term) for term in terms)]))
+
+    def q_many(self, terms):
+        """
+        All terms long enough for the trigram index go into a single MATCH and
+        one upper-cased ``IN`` on ``code``; short terms use the default scan.
+        """
+        indexed = [term for term in terms if len(term) >= self.min_length]
+        if not indexed or not self.available:
+            return super().q_many(terms)
+
+        q = self._match_q(indexed) | Q(code__in={term.upper() for term in indexed})
+        short = [term for term in terms if len(term) < self.min_length]
+        return q | super().q_many(short) if short else q
+
+    def install(self):
+        # SQLite builds without FTS5 (or older than 3.34) keep using the scan
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                    f"{', '.join(SEARCH_FIELDS)}, tokenize='trigram')"
+                )
+        except OperationalError:
+            pass
+
+        self._available = None
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+        self._available = None
+
+    def _insert(self, cursor, where="", params=()):
+        fields = ", ".join(SEARCH_FIELDS)
+        cursor.execute(
+            f"INSERT INTO {self.table} (rowid, {fields}) "
+            f"SELECT id, {fields} FROM {ENTITY_TABLE} {where}",
+            params,
+        )
+        return cursor.rowcount
+
+    def rebuild(self):
+        if not self.available:
+            return 0
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            return self._insert(cursor)
+
+    def remove(self, ids):
+        if ids and self.available:
+            placeholders = ", ".join(["%s"] * len(ids))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", ids
+                )
+
+    def update(self, ids):
+        if ids and self.available:
+            self.remove(ids)
+            placeholders = ", ".join(["%s"] * len(ids))
+            with connection.cursor() as cursor:
+                self._insert(cursor, f"WHERE id IN ({placeholders})", ids)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Keeps the default lookups, which PostgreSQL renders as
+    ``UPPER(col::text) LIKE UPPER(%s)``, and backs them with ``pg_trgm`` GIN
+    indexes on the same expressions. The indexes are maintained by the database
+    itself, so there is nothing to do on save.
+    """
+
+    index_name = ENTITY_TABLE + "_{}_trgm"
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for field in SEARCH_FIELDS:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.index_name.format(field)} "
+                    f"ON {ENTITY_TABLE} USING gin (UPPER({field}::text) gin_trgm_ops)"
+                )
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            for field in SEARCH_FIELDS:
+                cursor.execute(f"DROP INDEX IF EXISTS {self.index_name.format(field)}")
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for field in SEARCH_FIELDS:
+                cursor.execute(f"REINDEX INDEX {self.index_name.format(field)}")
+            cursor.execute(f"SELECT COUNT(*) FROM {ENTITY_TABLE}")
+            return cursor.fetchone()[0]
+
+
+@lru_cache
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_backend():
+    path = getattr(settings, "TRAVEL_SEARCH_BACKEND", None)
+    return _load_backend(
+        path or VENDOR_BACKENDS.get(connection.vendor, "travel.search.SearchBackend")
+    )
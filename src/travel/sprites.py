@@ -0,0 +1,224 @@
+"""
+A single SVG sprite holding every flag, so that a listing page draws all of
+its flags from one cacheable file instead of fetching one SVG per flag.
+
+The ``build_flag_sprite`` command writes each flag's SVG as a ``<symbol>``
+with the id ``flag-<pk>`` to ``SPRITE_NAME`` under ``MEDIA_ROOT``. The ids
+inside each flag are prefixed so that gradients and clip paths from
+different flags cannot collide. An index of the included flags is written
+next to the sprite.
+
+The ``flag_icon`` template tag draws flags that are in the index from the
+sprite, and falls back to an ``<img>`` for any other flag. Browsers only
+follow ``<use>`` references within the page's origin, so the sprite is
+served by the ``travel:flag-sprite`` view rather than from ``MEDIA_URL``,
+which may be a CDN. Its URL carries a hash of its content, so it can be
+cached indefinitely. Setting ``TRAVEL_FLAG_SPRITE`` to False always draws
+flags as images.
+
+The index records a hash of each flag's SVG. Saving a flag whose file no
+longer matches drops it from the index until the next build.
+"""
+import hashlib
+import os
+import re
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from .manifest import JSONSnapshot, write_atomic
+
+SPRITE_NAME = "travel/img/flag-sprite.svg"
+INDEX_NAME = "travel/img/flag-sprite.json"
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+HREFS = ("href", f"{{{XLINK_NS}}}href")
+# Root attributes that only make sense on a standalone document
+SKIP_ROOT_ATTRS = {"width", "height", "x", "y", "id", "version", "viewBox"}
+URL_REF = re.compile(r"url\(\s*['\"]?#([^)'\"\s]+)['\"]?\s*\)")
+
+ElementTree.register_namespace("", SVG_NS)
+ElementTree.register_namespace("xlink", XLINK_NS)
+
+
+def symbol_id(pk):
+    return f"flag-{pk}"
+
+
+def _view_box(root):
+    if view_box := root.get("viewBox"):
+        return view_box
+
+    try:
+        width, height = (
+            float(re.sub(r"[a-z%]+$", "", root.get(attr, "")))
+            for attr in ("width", "height")
+        )
+    except ValueError:
+        return None
+
+    return f"0 0 {width:g} {height:g}"
+
+
+def _prefix_ids(root, prefix):
+    ids = {el.get("id") for el in root.iter() if el.get("id")}
+    if not ids:
+        return
+
+    def rename(match):
+        return f"url(#{prefix}{match[1]})" if match[1] in ids else match[0]
+
+    for el in root.iter():
+        for key, value in el.attrib.items():
+            if key == "id":
+                el.set(key, prefix + value)
+            elif key in HREFS and value.startswith("#") and value[1:] in ids:
+                el.set(key, f"#{prefix}{value[1:]}")
+            elif "url(" in value:
+                el.set(key, URL_REF.sub(rename, value))
+
+        if el.tag == f"{{{SVG_NS}}}style" and el.text:
+            el.text = URL_REF.sub(rename, el.text)
+
+
+def make_symbol(pk, svg):
+    """
+    Convert the text of one flag SVG to a ``<symbol>`` element, returning it
+    with its view box.
+    """
+    root = ElementTree.fromstring(svg)
+    view_box = _view_box(root)
+    _prefix_ids(root, f"{symbol_id(pk)}-")
+
+    symbol = ElementTree.Element(f"{{{SVG_NS}}}symbol", id=symbol_id(pk))
+    if view_box:
+        symbol.set("viewBox", view_box)
+    for key, value in root.attrib.items():
+        if key not in SKIP_ROOT_ATTRS:
+            symbol.set(key, value)
+
+    symbol.extend(root)
+    return symbol, view_box
+
+
+def read_svg(name):
+    with default_storage.open(name) as fp:
+        return fp.read()
+
+
+def content_hash(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def sprite_path():
+    return os.path.join(settings.MEDIA_ROOT, SPRITE_NAME)
+
+
+def build_sprite(flags):
+    """
+    Build the sprite from ``(pk, svg_name)`` pairs. Returns the sprite text,
+    the index and the flags that could not be read or parsed.
+    """
+    sprite = ElementTree.Element(f"{{{SVG_NS}}}svg")
+    included = {}
+    skipped = []
+    for pk, name in flags:
+        try:
+            svg = read_svg(name)
+            symbol, view_box = make_symbol(pk, svg)
+        except (OSError, ElementTree.ParseError):
+            skipped.append(pk)
+            continue
+
+        sprite.append(symbol)
+        included[str(pk)] = [name, view_box, content_hash(svg)]
+
+    text = ElementTree.tostring(sprite, encoding="unicode")
+    digest = hashlib.md5(text.encode()).hexdigest()[:12]
+    return text, {"digest": digest, "flags": included}, skipped
+
+
+class FlagSprite(JSONSnapshot):
+    version_name = "flag-sprite"
+
+    def path(self):
+        return os.path.join(settings.MEDIA_ROOT, INDEX_NAME)
+
+    def url(self, index):
+        return f"{reverse('travel:flag-sprite')}?v={index['digest']}"
+
+    def load(self):
+        if not getattr(settings, "TRAVEL_FLAG_SPRITE", True):
+            return None
+
+        return super().load()
+
+    def lookup(self, flag):
+        """
+        The sprite URL and view box for ``flag``, or None if the sprite does
+        not hold its current SVG.
+        """
+        index = self.load()
+        if index is None or not flag.svg:
+            return None
+
+        name, view_box, _ = index["flags"].get(str(flag.pk), (None, None, None))
+        if name != flag.svg.name:
+            return None
+
+        return f"{self.url(index)}#{symbol_id(flag.pk)}", view_box
+
+    def client_data(self):
+        """
+        The sprite URL and a map from flag SVG URLs to symbol ids and view
+        boxes, for drawing flags in the browser.
+        """
+        index = self.load()
+        if index is None:
+            return None
+
+        return {
+            "url": self.url(index),
+            "symbols": {
+                default_storage.url(name): [symbol_id(pk), view_box]
+                for pk, (name, view_box, _) in index["flags"].items()
+            },
+        }
+
+    def rebuild(self, flags):
+        text, index, skipped = build_sprite(flags)
+        with self.locked():
+            write_atomic(sprite_path(), text)
+            self.write(index)
+
+        return len(index["flags"]), skipped
+
+    def refresh(self, flag):
+        """
+        Drop ``flag`` from the index if the sprite does not hold its current
+        SVG, so that it is drawn as an image until the next build.
+        """
+        if not os.path.exists(self.path()):
+            return
+
+        with self.locked():
+            index = self._read()
+            entry = index and index["flags"].get(str(flag.pk))
+            if entry is None:
+                return
+
+            name, _, digest = entry
+            if flag.svg and flag.svg.name == name:
+                try:
+                    if content_hash(read_svg(name)) == digest:
+                        return
+                except OSError:
+                    pass
+
+            del index["flags"][str(flag.pk)]
+            self.write(index)
+
+
+flag_sprite = FlagSprite()
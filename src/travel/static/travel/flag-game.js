@@ -1,20 +1,3 @@
-const randomInt = max => Math.floor(Math.random() * max);
-
-const shuffle = array => {
-    // http://stackoverflow.com/questions/2450954/how-to-randomize-shuffle-a-javascript-array
-    let currentIndex = array.length;
-
-    // While there remain elements to shuffle, pick one randomly and swap
-    while(0 !== currentIndex) {
-        const randomIndex = Math.floor(Math.random() * currentIndex--);
-        const temp = array[currentIndex];
-        array[currentIndex] = array[randomIndex];
-        array[randomIndex] = temp;
-    }
-
-  return array;
-}
-
 class ScoreCard {
     constructor() {
         this.correct = 0;
@@ -55,44 +38,29 @@ class View {
     }
 }
 
-const loadData = async (url) => {
-    const response = await fetch(url);
+const loadRound = async (url) => {
+    const response = await fetch(url, {cache: 'no-store'});
     const data = await response.json();
     return data;
 };
 
-class FlagData {
-    constructor(data) {
-        this.countries = data.countries.reduce((accum, value) => {
-            accum[value.code] = value;
-            return accum;
-        }, {});
-        this.groups = data.groups;
-    }
-}
-
 class Controller {
-    constructor(flags, view) {
-        this.currentIndex = 0;
-        this.flags = flags;
+    constructor(url, view) {
+        this.url = url;
         this.view = view;
         this.scoreCard = new ScoreCard();
-        shuffle(this.flags.groups);
-    }
-    next() {
-        if(this.currentIndex >= this.flags.groups.length) {
-            this.currentIndex = 0;
-        };
-        return shuffle(this.flags.groups[this.currentIndex++]);
+        this.nextRound = loadRound(url);
     }
-    cycle() {
-        const group = this.next();
-        this.currentCorrect = this.flags.countries[group[randomInt(group.length)]];
-        for(const [i, id] of group.entries()) {
-            this.view.updateImage(i, this.flags.countries[id])
+    async cycle() {
+        const round = await this.nextRound;
+        // Fetch the following round while this one is played
+        this.nextRound = loadRound(this.url);
+        this.currentCorrect = round;
+        for(const [i, country] of round.flags.entries()) {
+            this.view.updateImage(i, country)
         }
 
-        document.getElementById('co-name').textContent = this.currentCorrect.name;
+        document.getElementById('co-name').textContent = round.name;
         this.view.toggleCorrect();
     }
     play() {
@@ -114,8 +82,7 @@ class Controller {
     }
 };
 
-export const playFlagGame = async (url) => {
-    let data = await loadData(url);
-    const controller = new Controller(new FlagData(data), new View());
+export const playFlagGame = (url) => {
+    const controller = new Controller(url, new View());
     controller.play()
 };
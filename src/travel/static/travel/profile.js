@@ -25,6 +25,7 @@
 //   "user": 1
 // }
 //------------------------------------------------------------------------------
+const SVG_NS = 'http://www.w3.org/2000/svg';
 const MISSING_FLAG = 'data:image/svg+xml;utf8,<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-geo-alt-fill" viewBox="0 0 16 16"><path d="M8 16s6-5.686 6-10A6 6 0 0 0 2 6c0 4.314 6 10 6 10zm0-7a3 3 0 1 1 0-6 3 3 0 0 1 0 6z"/></svg>'
 const DATE_FORMAT  = 'YYYY-MM-DD';
 const TYPE_MAPPING = {
@@ -227,7 +228,8 @@ class TravelLogs {
 }
 
 class View {
-    constructor() {
+    constructor(sprite = null) {
+        this.sprite = sprite;
         this.dateEl = document.getElementById('id_date');
         this.yearEl = document.getElementById('id_year')
     }
@@ -308,6 +310,16 @@ class View {
             }
         }
     }
+    createFlagIcon(className, [id, viewBox]) {
+        const svg = document.createElementNS(SVG_NS, 'svg');
+        svg.setAttribute('class', className);
+        svg.setAttribute('role', 'img');
+        viewBox && svg.setAttribute('viewBox', viewBox);
+        const use = document.createElementNS(SVG_NS, 'use');
+        use.setAttribute('href', `${this.sprite.url}#${id}`);
+        svg.appendChild(use);
+        return svg;
+    }
     createLogRow(log) {
         let extras = [];
         const e = log.entity;
@@ -341,7 +353,13 @@ class View {
         logName.textContent = e.name;
 
         const logImage = node.querySelector('.log-image');
-        logImage.src = e.flag_svg || MISSING_FLAG;
+        const symbol = this.sprite && this.sprite.symbols[e.flag_svg];
+        if(symbol) {
+            logImage.replaceWith(this.createFlagIcon(logImage.className, symbol));
+        }
+        else {
+            logImage.src = e.flag_svg || MISSING_FLAG;
+        }
 
         const tr = node.querySelector('tr');
         tr.dataset.id = e.id;
@@ -493,11 +511,11 @@ class Controller  {
     }
 };
 
-const loadLogs = async (url) => {
+const loadLogs = async (url, sprite = null) => {
     const data = await loadData(url);
     const controller = new Controller(
         new LogModels(data),
-        new View()
+        new View(sprite)
     );
     return controller;
 };
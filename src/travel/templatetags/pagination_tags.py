@@ -28,10 +28,18 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import base64
+import binascii
+import json
+import operator
+from functools import reduce
+
 from django.http import Http404
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.core.paginator import Paginator, InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
 from django.template.base import TokenType
 from django.utils.text import unescape_string_literal
 from django.template import (
@@ -153,14 +161,183 @@ class AutoPaginateNode(Node):
         return ""
 
 
+def encode_cursor(values):
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        return None
+
+    if not isinstance(values, list) or len(values) != size:
+        return None
+
+    return values
+
+
+class KeysetPage:
+    """
+    A page of results bounded by the sort keys of its first and last rows,
+    rather than by an offset.
+    """
+
+    def __init__(self, object_list, fields, has_previous, has_next):
+        self.object_list = object_list
+        self.fields = fields
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    def _cursor(self, obj):
+        return encode_cursor([getattr(obj, field) for field in self.fields])
+
+    def previous_cursor(self):
+        return self._cursor(self.object_list[0]) if self._has_previous else None
+
+    def next_cursor(self):
+        return self._cursor(self.object_list[-1]) if self._has_next else None
+
+
+class KeysetPaginateNode(Node):
+    """
+    Like ``AutoPaginateNode``, but seeks to the current page using the sort
+    keys of the adjacent page (passed as the ``after`` or ``before`` request
+    parameter) instead of an ``OFFSET``, so every page costs the same as the
+    first one. No ``COUNT`` is issued; templates wanting a total should get it
+    from the view.
+
+    The queryset must be ordered by plain ascending fields (its own
+    ``order_by`` or the model's ``Meta.ordering``); the primary key is
+    appended as a tie-breaker.
+    """
+
+    def __init__(self, queryset_var, paginate_by=None, context_var=None):
+        paginate_by = paginate_by or config["default_pagination"]
+        self.queryset_var = Variable(queryset_var)
+        self.paginate_by = (
+            paginate_by if isinstance(paginate_by, int) else Variable(paginate_by)
+        )
+        self.context_var = context_var
+
+    @staticmethod
+    def sort_fields(queryset):
+        fields = list(queryset.query.order_by or queryset.model._meta.ordering)
+        for field in fields:
+            if not isinstance(field, str) or field.startswith("-") or "__" in field:
+                raise ImproperlyConfigured(
+                    f"keysetpaginate cannot page on {field!r}; "
+                    "order by ascending local fields only."
+                )
+
+        pk = queryset.model._meta.pk.attname
+        return [field for field in fields if field not in ("pk", pk)] + [pk]
+
+    @staticmethod
+    def seek_q(fields, values, lookup):
+        return reduce(
+            operator.or_,
+            [
+                Q(
+                    **dict(zip(fields[:i], values[:i])),
+                    **{f"{fields[i]}__{lookup}": values[i]},
+                )
+                for i in range(len(fields))
+            ],
+        )
+
+    def render(self, context):
+        key = self.queryset_var.var
+        queryset = self.queryset_var.resolve(context)
+        if isinstance(self.paginate_by, int):
+            paginate_by = self.paginate_by
+        else:
+            paginate_by = self.paginate_by.resolve(context)
+
+        try:
+            request = context["request"]
+        except KeyError:
+            raise ImproperlyConfigured(
+                "You need to enable 'django.core.context_processors.request'."
+            )
+
+        fields = self.sort_fields(queryset)
+        queryset = queryset.order_by(*fields)
+        after = request.GET.get("after")
+        before = request.GET.get("before")
+        cursor = after or before
+        values = cursor and decode_cursor(cursor, len(fields))
+        if cursor and values is None:
+            if config["invalid_page_raises_404"]:
+                raise Http404("Invalid pagination cursor.")
+            before = after = None
+
+        if before and values:
+            rows = list(
+                queryset.filter(self.seek_q(fields, values, "lt")).reverse()[
+                    : paginate_by + 1
+                ]
+            )
+            has_previous = len(rows) > paginate_by
+            rows = rows[:paginate_by][::-1]
+            has_next = True
+        else:
+            if after and values:
+                queryset = queryset.filter(self.seek_q(fields, values, "gt"))
+            rows = list(queryset[: paginate_by + 1])
+            has_next = len(rows) > paginate_by
+            rows = rows[:paginate_by]
+            has_previous = bool(after and values)
+
+        page_obj = KeysetPage(rows, fields, has_previous, has_next)
+        context[self.context_var or key] = page_obj.object_list
+        context["page_obj"] = page_obj
+        return ""
+
+
+def paginate_keyset(context):
+    page_obj = context["page_obj"]
+    new_context = {"page_obj": page_obj, "is_paginated": page_obj.has_other_pages()}
+    if "request" in context:
+        getvars = context["request"].GET.copy()
+        for name in ("after", "before"):
+            getvars.pop(name, None)
+        new_context["getvars"] = (
+            "&{}".format(getvars.urlencode()) if getvars else ""
+        )
+
+    return new_context
+
+
 class PaginateNode(Node):
 
     def __init__(self, template=None):
         self.template = template
 
     def render(self, context):
-        template_list = ["pagination/pagination.html"]
-        new_context = paginate(context)
+        if isinstance(context.get("page_obj"), KeysetPage):
+            template_list = ["pagination/keyset.html"]
+            new_context = paginate_keyset(context)
+        else:
+            template_list = ["pagination/pagination.html"]
+            new_context = paginate(context)
         if self.template:
             template_list.insert(0, self.template)
 
@@ -347,6 +524,34 @@ def do_autopaginate(parser, token):
     )
 
 
+@register.tag("keysetpaginate")
+def do_keysetpaginate(parser, token):
+    """
+    Syntax is:
+
+        keysetpaginate QUERYSET [PAGINATE_BY] [as NAME]
+    """
+    argv = token.split_contents()[1:]
+    context_var = None
+    if len(argv) > 2 and argv[-2] == "as":
+        context_var = argv[-1]
+        argv = argv[:-2]
+
+    if not 1 <= len(argv) <= 2:
+        raise TemplateSyntaxError(
+            "Invalid syntax. Proper usage of this tag is: "
+            "{% keysetpaginate QUERYSET [PAGINATE_BY] [as CONTEXT_VAR_NAME] %}"
+        )
+
+    paginate_by = argv[1] if len(argv) == 2 else None
+    try:
+        paginate_by = int(paginate_by)
+    except (TypeError, ValueError):
+        pass
+
+    return KeysetPaginateNode(argv[0], paginate_by, context_var)
+
+
 @register.tag("paginate")
 def do_paginate(parser, token):
     """
@@ -1,6 +1,9 @@
 from django import template
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
+from travel.sprites import flag_sprite
+
 register = template.Library()
 
 
@@ -65,3 +68,33 @@ ICON_MAPPINGS = {
 def travel_icon(name):
     name = ICON_MAPPINGS.get(name, name)
     return mark_safe(f'<i class="bi bi-{name}"></i>')
+
+
+@register.simple_tag
+def flag_icon(flag, css_class="flag-sm"):
+    """
+    Draw ``flag`` from the flag sprite when it holds the flag's SVG, or as an
+    ``<img>`` of its thumbnail otherwise.
+    """
+    if not flag:
+        return ""
+
+    found = flag_sprite.lookup(flag)
+    if found is None:
+        return format_html(
+            '<img class="flag {}" src="{}">', css_class, flag.thumb_url
+        )
+
+    href, view_box = found
+    view_box = format_html(' viewBox="{}"', view_box) if view_box else ""
+    return format_html(
+        '<svg class="flag {}"{} role="img"><use href="{}"></use></svg>',
+        css_class,
+        view_box,
+        href,
+    )
+
+
+@register.simple_tag
+def flag_sprite_data():
+    return flag_sprite.client_data()
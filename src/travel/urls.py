@@ -19,6 +19,11 @@ profile_patterns = [
     path("", views.AllProfilesView.as_view(), name="profiles"),
     path("<str:username>/", views.ProfileView.as_view(), name="profile"),
     path("<str:username>/calendar/", views.CalendarView.as_view(), name="calendar"),
+    path(
+        "<str:username>/history.json",
+        views.ProfileHistoryView.as_view(),
+        name="profile-history",
+    ),
     path(
         "<str:username>/log/<int:pk>/", views.LogEntryView.as_view(), name="log-entry"
     ),
@@ -49,6 +54,7 @@ urlpatterns = [
     path("languages/", views.LanguagesView.as_view(), name="languages"),
     path("languages/<int:pk>/", views.LanguageView.as_view(), name="language"),
     path("flags/", views.FlagGameView.as_view(), name="flag-quiz"),
+    path("flags/sprite.svg", views.FlagSpriteView.as_view(), name="flag-sprite"),
     path(
         "plugs/", TemplateView.as_view(template_name="travel/plugs.html"), name="plugs"
     ),
@@ -2,12 +2,50 @@ import re
 import json
 import calendar
 import datetime
-from collections import OrderedDict
+import unicodedata
+from collections.abc import Iterator
 from decimal import Decimal, localcontext
+from functools import lru_cache
 from urllib.parse import quote_plus, unquote
 
+from asgiref.sync import sync_to_async
 from dateutil.parser import parser, parserinfo
-from dateutil.tz import UTC
+from dateutil.tz import UTC, gettz
+
+
+@lru_cache(maxsize=512)
+def get_tzinfo(name):
+    """
+    Process-wide, bounded cache of ``dateutil`` tz objects by zone name, so
+    each zone file is parsed once.
+    """
+    return gettz(name)
+
+
+def resolve_timezones(rows, known=None):
+    """
+    Effective timezone of each entity in ``rows``, a dict of
+    ``id: (tz, state_id, country_id)``: its own ``tz``, else its state's, else
+    its country's, else UTC. Ancestors missing from ``rows`` are taken from
+    ``known``, a dict of ``id: effective timezone``.
+    """
+    resolved = dict(known or {})
+    pending = set()
+
+    def resolve(pk):
+        if pk in resolved:
+            return resolved[pk]
+        if pk not in rows or pk in pending:
+            return ""
+
+        pending.add(pk)
+        tz, state, country = rows[pk]
+        resolved[pk] = (
+            tz or (state and resolve(state)) or (country and resolve(country)) or "UTC"
+        )
+        return resolved[pk]
+
+    return {pk: resolve(pk) for pk in rows}
 
 
 def normalize_datetime_zone(when, tz):
@@ -17,12 +55,13 @@ def normalize_datetime_zone(when, tz):
     return datetime.datetime.utcnow().replace(tzinfo=UTC)
 
 
-def calendar_dict(dt):
-    cal = calendar.Calendar()
-    cal.setfirstweekday(calendar.SUNDAY)
-    return OrderedDict(
-        ((d.month, d.day), []) for d in list(cal.itermonthdates(dt.year, dt.month))
-    )
+def calendar_dates(year, month):
+    """
+    Every date shown on a Sunday-first month grid, including the days of the
+    adjoining months that fill its first and last weeks.
+    """
+    cal = calendar.Calendar(calendar.SUNDAY)
+    return list(cal.itermonthdates(year, month))
 
 
 class DateParserInfo(parserinfo):
@@ -35,6 +74,30 @@ class DateParserInfo(parserinfo):
 dt_parser = parser(DateParserInfo()).parse
 
 
+SEARCH_PUNCTUATION_RE = re.compile(r"[\W_]+")
+
+
+def normalize_search_text(text):
+    """
+    Accent-folded, case-folded text with punctuation and runs of whitespace
+    collapsed to single spaces, so that "Côte d’Ivoire", "cote d'ivoire" and
+    "Cote d Ivoire" compare equal.
+    """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return SEARCH_PUNCTUATION_RE.sub(" ", text.casefold()).strip()
+
+
+def search_tokens(text):
+    """
+    Every suffix of the normalized ``text`` that starts at a word boundary,
+    allowing a prefix lookup to match on any word: "Côte d'Ivoire" yields
+    "cote d ivoire", "d ivoire" and "ivoire".
+    """
+    words = normalize_search_text(text).split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
 def normalize_file_from_url(u):
     fn = u.rsplit("/", 1)
     fn = fn[1] if len(fn) == 2 else fn[0]
@@ -143,9 +206,175 @@ def object_hook(dct):
     return dct
 
 
-def json_dumps(obj, cls=TravelJsonEncoder, **kws):
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+EPOCH_NAIVE = EPOCH.replace(tzinfo=None)
+MILLISECOND = datetime.timedelta(milliseconds=1)
+
+COMPACT_ENCODERS = dict(
+    datetime=lambda o: (o - EPOCH) // MILLISECOND,
+    datetime_naive=lambda o: (o - EPOCH_NAIVE) // MILLISECOND,
+    date=datetime.date.isoformat,
+    time=datetime.time.isoformat,
+    decimal=str,
+)
+
+COMPACT_PARSERS = dict(
+    datetime=lambda o: EPOCH + datetime.timedelta(milliseconds=o),
+    datetime_naive=lambda o: EPOCH_NAIVE + datetime.timedelta(milliseconds=o),
+    date=datetime.date.fromisoformat,
+    time=datetime.time.fromisoformat,
+    decimal=Decimal,
+)
+
+
+def _compact_kind(value):
+    if isinstance(value, datetime.datetime):
+        return "datetime_naive" if value.utcoffset() is None else "datetime"
+    elif isinstance(value, datetime.date):
+        return "date"
+    elif isinstance(value, datetime.time):
+        return "time"
+    elif isinstance(value, Decimal):
+        return "decimal"
+
+
+def _compact_value(value, key, schema, plain):
+    if isinstance(value, dict):
+        return {k: _compact_value(v, str(k), schema, plain) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_compact_value(v, key, schema, plain) for v in value]
+
+    kind = _compact_kind(value)
+    if kind is None:
+        if value is not None:
+            plain.add(key)
+        return value
+
+    if schema.setdefault(key, kind) != kind:
+        raise TypeError(f"Mixed {schema[key]} and {kind} values under {key!r}")
+
+    return COMPACT_ENCODERS[kind](value)
+
+
+def compact_payload(obj):
+    """
+    The compact wire format: datetimes as epoch milliseconds, decimals, dates
+    and times as strings, with a ``schema`` header naming the type found under
+    each dict key (``""`` for values outside any dict). Every non-null value
+    under a schema key must have that type. Datetimes are truncated to the
+    millisecond.
+    """
+    schema, plain = {}, set()
+    data = _compact_value(obj, "", schema, plain)
+    mixed = plain & schema.keys()
+    if mixed:
+        raise TypeError(f"Mixed typed and plain values under {sorted(mixed)}")
+
+    return {"schema": schema, "data": data}
+
+
+def _collect_compact(container, index, key, schema, targets):
+    value = container[index]
+    if isinstance(value, dict):
+        for k in value:
+            _collect_compact(value, k, k, schema, targets)
+    elif isinstance(value, list):
+        for i in range(len(value)):
+            _collect_compact(value, i, key, schema, targets)
+    elif value is not None and key in schema:
+        targets[schema[key]].append((container, index))
+
+
+def decode_compact(payload):
+    """
+    Restore the values in a ``compact_payload``. Rather than inspecting every
+    dict as ``object_hook`` does, the typed values are located first and then
+    converted one type at a time.
+    """
+    schema = payload["schema"]
+    targets = {kind: [] for kind in set(schema.values())}
+    _collect_compact(payload, "data", "", schema, targets)
+    for kind, refs in targets.items():
+        values = map(COMPACT_PARSERS[kind], [c[i] for c, i in refs])
+        for (container, index), value in zip(refs, values):
+            container[index] = value
+
+    return payload["data"]
+
+
+def json_dumps(obj, cls=TravelJsonEncoder, compact=False, **kws):
+    if compact:
+        return json.dumps(compact_payload(obj), separators=(",", ":"), **kws)
+
     return json.dumps(obj, indent=kws.pop("indent", 4), cls=cls, **kws)
 
 
-def json_loads(s, object_hook=object_hook, **kws):
+def _is_lazy(obj):
+    return hasattr(obj, "iterator") or isinstance(obj, Iterator)
+
+
+def _iter_json(obj, encoder, chunk_size):
+    if isinstance(obj, dict):
+        if not any(_is_lazy(value) for value in obj.values()):
+            yield encoder.encode(obj)
+            return
+
+        yield "{"
+        for i, (key, value) in enumerate(obj.items()):
+            yield "{}{}:".format("," if i else "", encoder.encode(str(key)))
+            yield from _iter_json(value, encoder, chunk_size)
+        yield "}"
+    elif _is_lazy(obj) or isinstance(obj, (list, tuple)):
+        if hasattr(obj, "iterator"):
+            obj = obj.iterator(chunk_size=chunk_size)
+
+        yield "["
+        for i, item in enumerate(obj):
+            if i:
+                yield ","
+            yield from _iter_json(item, encoder, chunk_size)
+        yield "]"
+    else:
+        yield encoder.encode(obj)
+
+
+def iter_json(obj, cls=TravelJsonEncoder, chunk_size=2000, buffer_size=64 * 1024):
+    """
+    Encode ``obj`` as compact JSON, yielding the text in pieces of roughly
+    ``buffer_size`` characters.
+
+    Querysets (anything with an ``iterator()`` method) are read in chunks of
+    ``chunk_size`` rows and other iterators are consumed lazily, so only one
+    chunk of rows is held in memory at a time. Dicts and lists containing
+    neither are encoded in one go.
+    """
+    encoder = cls(separators=(",", ":"))
+    buffer, size = [], 0
+    for fragment in _iter_json(obj, encoder, chunk_size):
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= buffer_size:
+            yield "".join(buffer)
+            buffer, size = [], 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+async def aiter_json(obj, **kws):
+    """
+    ``iter_json`` as an async iterator. Each piece is encoded by
+    ``sync_to_async``, on the thread that holds the database connection, so
+    querysets are still read a chunk at a time.
+    """
+    pieces = iter_json(obj, **kws)
+    done = object()
+    while (piece := await sync_to_async(next)(pieces, done)) is not done:
+        yield piece
+
+
+def json_loads(s, object_hook=object_hook, compact=False, **kws):
+    if compact:
+        return decode_compact(json.loads(s, **kws))
+
     return json.loads(s, object_hook=object_hook, **kws)
@@ -1,16 +1,23 @@
-from datetime import timedelta
+from collections import defaultdict
+from datetime import MAXYEAR, MINYEAR, date, datetime, time, timedelta
 
+from asgiref.sync import sync_to_async
 from django import http
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Max
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.contrib.auth.models import User
 from django.utils.functional import cached_property
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
 import vanilla
 
 from . import models as travel
 from . import forms
+from . import registry
+from . import sprites
 from . import utils
 
 
@@ -18,6 +25,14 @@ def split_code(code):
     return code.split("-", 1) if "-" in code else (code, None)
 
 
+def entity_type_or_404(abbr):
+    entity_type = registry.entity_types.find(abbr)
+    if entity_type is None:
+        raise http.Http404("No entity type matches the given query.")
+
+    return entity_type
+
+
 class TravelMixin:
 
     def get_template_names(self):
@@ -32,61 +47,147 @@ class TravelMixin:
 
 
 class CalendarView(TravelMixin, vanilla.TemplateView):
+    """
+    A month grid of the user's logs, or with ``?view=year`` all twelve months
+    of a year. Either way the logs come from a single range query covering
+    exactly the visible dates.
+    """
+
     template_name = "profile/calendar.html"
+    query_budget = 5
+
+    # Keep a year either side, so the grid and the neighbouring month and
+    # year links stay within the dates Python can represent
+    MIN_YEAR = MINYEAR + 1
+    MAX_YEAR = MAXYEAR - 1
+
+    def get_when(self, now, year_view):
+        try:
+            bits = [int(i) for i in self.request.GET["when"].split("-")]
+            year = min(max(bits[0], self.MIN_YEAR), self.MAX_YEAR)
+            return date(year, 1 if year_view else bits[1], 1)
+        except (KeyError, IndexError, ValueError):
+            return date(now.year, 1 if year_view else now.month, 1)
+
+    def get_logs(self, user, first, last):
+        tz = timezone.get_current_timezone()
+        by_date = defaultdict(list)
+        for name, abbr, arrival, emoji in (
+            user.travellog_set.filter(
+                arrival__gte=datetime.combine(first, time.min, tz),
+                arrival__lt=datetime.combine(last + timedelta(days=1), time.min, tz),
+            )
+            .order_by("arrival")
+            .values_list(
+                "entity__name", "entity__type__abbr", "arrival", "entity__flag__emoji"
+            )
+        ):
+            by_date[timezone.localtime(arrival, tz).date()].append(
+                [name, abbr, arrival, emoji]
+            )
+
+        return by_date
+
+    @staticmethod
+    def get_weeks(dates, by_date):
+        days = [(d, by_date.get(d, [])) for d in dates]
+        return [days[i:][:7] for i in range(0, len(days), 7)]
 
     def get_context_data(self, **kwargs):
         profile = get_object_or_404(
-            travel.TravelProfile.objects.public().select_related("user"),
+            # public() would also prefetch every log the user has
+            travel.TravelProfile.objects.public().prefetch_related(None),
             user__username=self.kwargs["username"],
         )
-        user = profile.user
-        when = self.request.GET.get("when")
+        year_view = self.request.GET.get("view") == "year"
         now = timezone.now()
-        dt = now.replace(day=15)
-        if when:
-            year, month = [int(i) for i in when.split("-")]
-            dt = dt.replace(year=year, month=month)
-
-        dates = utils.calendar_dict(dt)
-        for name, abbr, arrival, emoji in user.travellog_set.filter(
-            arrival__month=dt.month
-        ).values_list(
-            "entity__name", "entity__type__abbr", "arrival", "entity__flag__emoji"
-        ):
-            key = (arrival.month, arrival.day)
-            if key in dates:
-                dates[key].append([name, abbr, arrival, emoji])
-
-        dates = list(dates.items())
+        when = self.get_when(now, year_view)
+        months = [date(when.year, m, 1) for m in range(1, 13)] if year_view else [when]
+        grids = [utils.calendar_dates(m.year, m.month) for m in months]
+        by_date = self.get_logs(profile.user, grids[0][0], grids[-1][-1])
+        calendars = [(m, self.get_weeks(g, by_date)) for m, g in zip(months, grids)]
+        prev_month = when - timedelta(days=1)
         return super().get_context_data(
             profile=profile,
-            dates=[dates[i: i + 7] for i in range(0, len(dates), 7)],
+            year_view=year_view,
+            calendars=calendars,
+            dates=calendars[0][1],
             now=now,
-            when=dt,
-            prev_month=dt.replace(day=1) - timedelta(days=1),
-            next_month=dt + timedelta(days=31),
+            today=timezone.localdate(now),
+            when=when,
+            prev_month=prev_month,
+            next_month=when + timedelta(days=31),
+            prev_year=when.replace(year=when.year - 1),
+            next_year=when.replace(year=when.year + 1),
         )
 
 
 class FlagGameView(TravelMixin, vanilla.TemplateView):
     template_name = "flag-game.html"
+    query_budget = 3
+
+
+class FlagSpriteView(vanilla.View):
+    """
+    Serves the flag sprite from the site's own origin, which browsers require
+    of the documents that ``<use>`` references.
+    """
+
+    query_budget = 0
+
+    def get(self, request):
+        index = sprites.flag_sprite.load()
+        if index is None:
+            raise http.Http404("No flag sprite has been built.")
+
+        etag = '"{}"'.format(index["digest"])
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                sprite = open(sprites.sprite_path(), "rb")
+            except FileNotFoundError:
+                raise http.Http404("No flag sprite has been built.")
+
+            response = http.FileResponse(sprite, content_type="image/svg+xml")
+
+        response["ETag"] = etag
+        if request.GET.get("v") == index["digest"]:
+            # The URL names this exact content
+            patch_cache_control(
+                response, public=True, max_age=60 * 60 * 24 * 365, immutable=True
+            )
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+
+        return response
 
 
 class AllProfilesView(TravelMixin, vanilla.ListView):
     template_name = "profile/all.html"
-    model = travel.TravelProfile
     context_object_name = "profiles"
+    query_budget = 4
+
+    def get_queryset(self):
+        return travel.TravelProfile.objects.select_related("user").annotate(
+            log_count=Count("user__travellog_set"),
+            last_arrival=Max("user__travellog_set__arrival"),
+        )
 
 
 class ProfileView(TravelMixin, vanilla.DetailView):
     template_name = "profile/profile.html"
     context_object_name = "profile"
-    lookup_field = "user__username"
-    lookup_url_kwarg = "username"
+    query_budget = 4
 
     def get_queryset(self):
         return travel.TravelProfile.objects.select_related("user")
 
+    async def get(self, request, *args, **kwargs):
+        self.object = await aget_object_or_404(
+            self.get_queryset(), user__username=kwargs["username"]
+        )
+        return self.render_to_response(self.get_context_data())
+
     def get_context_data(self, **kwargs):
         return super().get_context_data(
             api_user_log_url=reverse(
@@ -95,40 +196,82 @@ class ProfileView(TravelMixin, vanilla.DetailView):
         )
 
 
+class ProfileHistoryView(vanilla.View):
+    """
+    Streams a user's history as JSON. Under ASGI the body is an async
+    iterator, as Django reads a sync one to the end before sending it.
+    """
+
+    query_budget = 6
+
+    def get(self, request, username):
+        profile = get_object_or_404(
+            travel.TravelProfile.objects.select_related("user"), user__username=username
+        )
+        if not (profile.is_public or profile.user == request.user):
+            raise http.Http404("No profile matches the given query.")
+
+        if request.GET.get("format") == "compact":
+            return http.HttpResponse(
+                travel.TravelLog.history_json(profile.user, compact=True),
+                content_type="application/json",
+            )
+
+        return http.StreamingHttpResponse(
+            travel.TravelLog.iter_history_json(
+                profile.user, asynchronous=isinstance(request, ASGIRequest)
+            ),
+            content_type="application/json",
+        )
+
+
 class LocaleView(TravelMixin, vanilla.ListView):
     template_name = "entities/listing/{}.html"
     context_object_name = "entities"
-
-    @cached_property
-    def entity_type(self):
-        return get_object_or_404(travel.TravelEntityType, abbr=self.kwargs["ref"])
+    query_budget = 7
 
     def get_template_names(self):
         self.template_name = self.template_name.format(self.entity_type.abbr)
         return super().get_template_names()
 
-    def get_context_data(self, **kwargs):
-        return super().get_context_data(type=self.entity_type, **kwargs)
-
     def get_queryset(self):
-        return travel.TravelEntity.objects.type_related(self.entity_type)
+        # Filter by the type itself rather than by abbreviation, which would
+        # go back to the registry
+        entities = travel.TravelEntity.objects
+        return entities.type_related(
+            self.entity_type, entities.filter(type=self.entity_type)
+        )
+
+    async def get(self, request, *args, **kwargs):
+        # The registry and the count cache may fall back to the database. The
+        # listing itself is paged and evaluated while the template renders.
+        self.entity_type = await sync_to_async(entity_type_or_404)(kwargs["ref"])
+        total = await sync_to_async(travel.TravelEntity.objects.type_count)(
+            self.entity_type
+        )
+        self.object_list = self.get_queryset()
+        context = self.get_context_data(type=self.entity_type, total=total)
+        return self.render_to_response(context)
 
 
 class LanguagesView(TravelMixin, vanilla.ListView):
     template_name = "languages.html"
     model = travel.TravelLanguage
     context_object_name = "languages"
+    query_budget = 4
 
 
 class LanguageView(TravelMixin, vanilla.DetailView):
     template_name = "languages.html"
     model = travel.TravelLanguage
     context_object_name = "language"
+    query_budget = 5
 
 
 class BucketListsView(TravelMixin, vanilla.ListView):
     template_name = "buckets/listing.html"
     context_object_name = "bucket_lists"
+    query_budget = 5
 
     def get_queryset(self):
         return travel.TravelBucketList.objects.for_user(self.request.user)
@@ -138,6 +281,7 @@ class BucketListView(TravelMixin, vanilla.DetailView):
     template_name = "buckets/detail.html"
     model = travel.TravelBucketList
     context_object_name = "bucket_list"
+    query_budget = 8
 
     @cached_property
     def user(self):
@@ -157,6 +301,7 @@ class BucketListComparisonView(TravelMixin, vanilla.DetailView):
     template_name = "buckets/compare.html"
     model = travel.TravelBucketList
     context_object_name = "bucket_list"
+    query_budget = 8
 
     def get_context_data(self, **kwargs):
         usernames = self.kwargs["usernames"].split("/")
@@ -180,6 +325,7 @@ class LogEntryView(TravelMixin, vanilla.UpdateView):
     template_name = "log-entry.html"
     model = travel.TravelLog
     context_object_name = "entry"
+    query_budget = 8
 
     def get_queryset(self):
         return self.model.objects.filter(user__username=self.kwargs["username"])
@@ -199,45 +345,58 @@ class LogEntryView(TravelMixin, vanilla.UpdateView):
 
 class SearchView(TravelMixin, vanilla.TemplateView):
     template_name = "search/search.html"
+    query_budget = 5
 
-    def get_context_data(self, **kwargs):
-        search_form = forms.SearchForm(self.request.GET)
+    async def get(self, request, *args, **kwargs):
+        search_form = forms.SearchForm(request.GET)
         data = {"search_form": search_form}
         if search_form.is_valid():
             q = search_form.cleaned_data["search"]
             by_type = search_form.cleaned_data["type"]
-            data.update(
-                search=q,
-                by_type=by_type,
-                results=travel.TravelEntity.objects.search(q, by_type),
+            # This only builds the queryset, which the template evaluates, but
+            # filtering by type looks the type up in the registry, which may
+            # fall back to the database
+            results = await sync_to_async(travel.TravelEntity.objects.search)(
+                q, by_type
             )
+            data.update(search=q, by_type=by_type, results=results)
 
-        return super().get_context_data(**{**data, **kwargs})
+        return self.render_to_response(self.get_context_data(**data))
 
 
 class AdvancedSearchView(TravelMixin, LoginRequiredMixin, vanilla.TemplateView):
     template_name = "search/advanced.html"
+    query_budget = 6
 
     def get_context_data(self, **kwargs):
-        results = None
+        results = resolved = None
         search = self.request.GET.get("search", "").strip()
         if search:
-            lines = [line.strip() for line in search.splitlines()]
-            results = travel.TravelEntity.objects.advanced_search(lines)
+            resolved = travel.TravelEntity.objects.resolve(search.splitlines())
+            results = travel.TravelEntity.objects.by_ids(
+                {i for ids in resolved.values() for i in ids}
+            )
 
-        return super().get_context_data(results=results, search=search, **kwargs)
+        return super().get_context_data(
+            results=results,
+            search=search,
+            resolved=resolved,
+            unresolved=[line for line, ids in (resolved or {}).items() if not ids],
+            **kwargs,
+        )
 
 
 class EntityRelationshipsView(TravelMixin, vanilla.TemplateView):
     template_name = "entities/listing/{}.html"
+    query_budget = 8
 
     @cached_property
     def relative_type(self):
-        return get_object_or_404(travel.TravelEntityType, abbr=self.kwargs["rel"])
+        return entity_type_or_404(self.kwargs["rel"])
 
     @cached_property
     def entity_type(self):
-        return get_object_or_404(travel.TravelEntityType, abbr=self.kwargs["ref"])
+        return entity_type_or_404(self.kwargs["ref"])
 
     def get_template_names(self):
         self.template_name = self.template_name.format(self.relative_type.abbr)
@@ -251,21 +410,29 @@ class EntityRelationshipsView(TravelMixin, vanilla.TemplateView):
 
         rel = self.relative_type
         return super().get_context_data(
-            type=rel, entities=entity.related_by_type(rel), parent=entity, **kwargs
+            type=rel,
+            entities=entity.related_by_type(rel),
+            total=dict(entity.cached_relationships).get(rel.abbr, 0),
+            parent=entity,
+            **kwargs,
         )
 
 
 class EntityView(TravelMixin, vanilla.DetailView):
     form_class = forms.TravelLogForm
+    query_budget = 14
 
     def get_form(self, data=None, files=None, **kwargs):
         cls = self.get_form_class()
         return cls(data=data, files=files, **kwargs)
 
-    def get_object(self):
-        ref = self.kwargs["ref"]
+    async def aget_object(self):
         code, aux = split_code(self.kwargs["code"])
-        return get_object_or_404(travel.TravelEntity.objects.find(ref, code, aux))
+        # Finding the type in the registry may fall back to the database
+        queryset = await sync_to_async(travel.TravelEntity.objects.find)(
+            self.kwargs["ref"], code, aux
+        )
+        return await aget_object_or_404(queryset)
 
     def get_template_names(self):
         ref = self.kwargs["ref"]
@@ -275,30 +442,36 @@ class EntityView(TravelMixin, vanilla.DetailView):
         ]
         return super().get_template_names()
 
-    def post(self, request, *args, **kwargs):
-        if not request.user.is_authenticated:
+    async def post(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
             return http.HttpResponseNotAllowed(["get"])
 
-        self.object = self.get_object()
-        form = self.get_form(entity=self.object, data=self.request.POST)
-        if form.is_valid():
-            form.save(self.request.user)
-            return http.HttpResponseRedirect(self.request.path)
+        self.object = await self.aget_object()
+        form = self.get_form(entity=self.object, data=request.POST)
+        if await sync_to_async(form.is_valid)():
+            await sync_to_async(form.save)(user)
+            return http.HttpResponseRedirect(request.path)
 
-        context = self.get_context_data(form=form)
-        return self.render_to_response(context)
+        return self.render_to_response(await self.aget_context_data(user, form=form))
 
-    def get(self, request, *args, **kwargs):
-        self.object = self.get_object()
+    async def get(self, request, *args, **kwargs):
+        user = await request.auser()
+        self.object = await self.aget_object()
         form = self.get_form(entity=self.object)
-        context = self.get_context_data(form=form)
-        return self.render_to_response(context)
+        return self.render_to_response(await self.aget_context_data(user, form=form))
 
-    def get_context_data(self, **kwargs):
-        entity = self.object
-        user = self.request.user
-        history = (
-            user.travellog_set.filter(entity=entity) if user.is_authenticated else []
-        )
+    async def get_history(self, user):
+        if not user.is_authenticated:
+            return []
+
+        return [log async for log in user.travellog_set.filter(entity=self.object)]
+
+    async def get_related_entities(self):
+        # Fills the cached property, from the cache or the database
+        return await sync_to_async(lambda: self.object.related_entities)()
 
-        return super().get_context_data(entity=entity, history=history, **kwargs)
+    async def aget_context_data(self, user, **kwargs):
+        history = await self.get_history(user)
+        await self.get_related_entities()
+        return self.get_context_data(entity=self.object, history=history, **kwargs)
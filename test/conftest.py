@@ -1,8 +1,14 @@
 import pytest
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from travel.models import TravelEntityType, TravelEntity, TravelBucketList
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
 @pytest.fixture
 def user():
     return User.objects.create_user(username="user")
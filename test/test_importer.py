@@ -0,0 +1,89 @@
+import io
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+
+from travel import importer
+from travel.models import TravelEntity, TravelLog, TravelLogHistory
+
+CSV = b"""type,code,arrival,rating,notes
+co,CO,2020-01-02 10:00,1,first
+co,XX,2020-01-03,,
+cn,CN,not a date,,
+cn,CN,2020-01-04T10:00:00+02:00,9,
+co,CO,2020-01-05,,
+"""
+
+GPX = b"""<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+  <wpt lat="1" lon="2"><name>CO</name><time>2020-01-02T10:00:00Z</time></wpt>
+  <wpt lat="1" lon="2"><name>CN</name><type>cn</type><desc>hi</desc>
+    <time>2020-01-03T10:00:00Z</time></wpt>
+</gpx>
+"""
+
+
+@pytest.mark.django_db
+class TestImporter:
+
+    def test_csv(self, user, country, continent, django_assert_max_num_queries):
+        TravelLog.objects.cached_checklist(user)
+        TravelLogHistory.objects.rebuild(user)
+        with django_assert_max_num_queries(6):
+            result = importer.import_logs(user, io.BytesIO(CSV), "csv")
+
+        assert result.created == 2
+        assert [line for line, _ in result.errors] == [3, 4, 5]
+        assert TravelLog.objects.cached_checklist(user) == {country.id}
+        assert not TravelLogHistory.objects.filter(user=user).exists()
+
+        log = TravelLog.objects.filter(user=user).earliest()
+        assert (log.rating, log.notes) == (1, "first")
+
+    def test_json_and_gpx(self, user, country, continent, country_type):
+        for name in ["Dup", "Dup2"]:
+            TravelEntity.objects.create(
+                type=country_type, code="DD", name=name, full_name=name
+            )
+        data = b'{"code": "CO", "arrival": "2020-01-02"}\n\n{"type": "cn"}\n[1]\n'
+        result = importer.import_logs(user, io.BytesIO(data), "json", "co")
+        assert result.created == 1
+        assert [line for line, _ in result.errors] == [3, 4]
+
+        data = b'[{"type": "co", "code": "DD", "arrival": "2020-01-02"}]'
+        result = importer.import_logs(user, io.BytesIO(data), "json")
+        assert result.errors == [(1, "Ambiguous entity: co DD")]
+
+        result = importer.import_logs(user, io.BytesIO(GPX), "gpx", "co")
+        assert (result.created, result.errors) == (2, [])
+        assert TravelLog.objects.filter(user=user, entity=continent).get().notes == "hi"
+
+    def test_unreadable(self, user, country, continent, client):
+        TravelLog.objects.cached_checklist(user)
+        data = GPX.replace(b"</gpx>", b"<wpt>")
+        with pytest.raises(ValueError, match="Invalid GPX"):
+            importer.import_logs(user, io.BytesIO(data), "gpx", "co", batch_size=1)
+
+        # The batches written before the error are kept, and the caches cleared
+        assert TravelLog.objects.cached_checklist(user) == {country.id, continent.id}
+
+        data = CSV + "co,CO,2020-01-06,,caf\xe9\n".encode("latin-1")
+        with pytest.raises(ValueError, match="Invalid UTF-8"):
+            importer.import_logs(user, io.BytesIO(data), "csv")
+
+        client.force_login(user)
+        url = reverse("travel:user_log_import_api", args=[user.username])
+        upload = SimpleUploadedFile("logs.gpx", b"<gpx><wpt>")
+        r = client.post(url, {"file": upload})
+        assert r.status_code == 400
+        assert r.json()["detail"].startswith("Invalid GPX")
+
+    def test_command(self, user, country, tmp_path):
+        path = tmp_path / "logs.csv"
+        path.write_bytes(CSV)
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_logs", user.username, str(path), stdout=out, stderr=err)
+        assert "Imported 2 logs, 3 errors." in out.getvalue()
+        assert "Unknown entity: co XX" in err.getvalue()
@@ -0,0 +1,237 @@
+import pytest
+
+from travel import caching, registry, search, utils
+from travel.models import (
+    TravelAlias,
+    TravelEntity,
+    TravelEntityClosure,
+    TravelEntityType,
+    TravelLog,
+    TravelSearchToken,
+)
+
+
+@pytest.mark.django_db
+class TestEntitySearch:
+
+    def results(self, term, type=None):
+        return set(TravelEntity.objects.search(term, type).values_list("code", flat=True))
+
+    def test_search(self, country, continent):
+        assert self.results("ountr") == {"CO"}
+        assert self.results("CONTINENT") == {"CN"}
+        assert self.results("nent", "co") == set()
+        assert self.results("ry") == {"CO"}
+        assert self.results("") == set()
+
+    def test_index_matches_scan(self, country, continent):
+        scan = search.SearchBackend()
+        country.name = "Côte d'Ivoire"
+        country.save()
+        for term in ["ivoire", "d'iv", "on", "Co", "nt", "XX"]:
+            expect = set(
+                TravelEntity.objects.filter(scan.q(term)).values_list("code", flat=True)
+            )
+            assert self.results(term) == expect
+
+    def test_index_follows_deletes(self, country):
+        assert self.results("ountr") == {"CO"}
+        country.delete()
+        assert self.results("ountr") == set()
+
+    def test_alias_tokens(self, country):
+        country.name = "Côte d’Ivoire"
+        country.save()
+        assert self.results("Cote d'Ivoire") == {"CO"}
+        assert self.results("ivo") == {"CO"}
+
+        alias = TravelAlias.objects.create(entity=country, alias="Elfenbeinküste")
+        assert self.results("elfenbeinkuste") == {"CO"}
+
+        alias.delete()
+        assert self.results("elfenbeinkuste") == set()
+
+    def test_rebuild_tokens(self, country, continent):
+        TravelSearchToken.objects.all().delete()
+        assert TravelSearchToken.objects.rebuild() > 0
+        assert set(
+            TravelSearchToken.objects.prefix("CONT").values_list("entity__code", flat=True)
+        ) == {"CN"}
+
+    def test_resolve(self, country, continent):
+        TravelAlias.objects.create(entity=country, alias="Land of Country")
+        resolved = TravelEntity.objects.resolve(
+            ["co", " Country", "land of country", "", "ntinen", "cont", "zzz", "co"]
+        )
+        assert resolved == {
+            "co": [country.id],
+            "Country": [country.id],
+            "land of country": [country.id],
+            "ntinen": [continent.id],
+            "cont": [continent.id],
+            "zzz": [],
+        }
+        assert TravelEntity.objects.resolve(["Country"], "cn") == {"Country": []}
+        assert set(TravelEntity.objects.advanced_search(["cn", "ount"])) == {
+            continent,
+            country,
+        }
+
+
+@pytest.mark.django_db
+class TestLogs:
+
+    def test_cached_checklist(self, user, country, continent, django_assert_num_queries):
+        TravelLog.objects.create(user=user, entity=country)
+        with django_assert_num_queries(1):
+            assert TravelLog.objects.cached_checklist(user) == {country.id}
+            assert TravelLog.objects.cached_checklist(user) == {country.id}
+
+        log = TravelLog.objects.create(user=user, entity=continent)
+        assert TravelLog.objects.cached_checklist(user) == {country.id, continent.id}
+
+        log.delete()
+        assert TravelLog.objects.cached_checklist(user) == {country.id}
+
+
+@pytest.mark.django_db
+class TestEntityClosure:
+
+    def test_relationships(self, continent, country, continent_type, country_type):
+        city_type = TravelEntityType.objects.create(abbr="ct", title="City")
+        city = TravelEntity.objects.create(
+            type=city_type, code="CT", name="City", full_name="City", country=country
+        )
+        assert dict(continent.relationships) == {"co": 1, "ct": 1}
+        assert dict(country.relationships) == {"ct": 1}
+        assert list(continent.related_by_type(city_type)) == [city]
+        assert list(continent.related_by_type(country_type)) == [country]
+
+        # Cities are listed through their country, so one linked to the
+        # continent directly is not counted
+        TravelEntity.objects.create(
+            type=city_type, code="C2", name="City 2", continent=continent
+        )
+        assert dict(continent.relationships) == {"co": 1, "ct": 1}
+        counts = TravelEntityClosure.objects.relationship_counts(
+            "cn", TravelEntity.Related.ENTITY_TYPES["cn"]
+        )
+        assert dict(counts[continent.pk]) == {"co": 1, "ct": 1}
+        assert list(continent.related_by_type(city_type)) == [city]
+
+        other = TravelEntity.objects.create(
+            type=continent_type, code="OT", name="Other", full_name="Other"
+        )
+        country.continent = other
+        country.save()
+        assert dict(continent.relationships) == {}
+        assert dict(other.relationships) == {"co": 1, "ct": 1}
+
+        country.delete()
+        assert dict(other.relationships) == {}
+        assert TravelEntityClosure.objects.filter(descendant=city).count() == 0
+
+    def test_rebuild(self, continent, country):
+        TravelEntityClosure.objects.all().delete()
+        assert dict(continent.relationships) == {}
+        assert TravelEntityClosure.objects.rebuild() == 1
+        assert dict(continent.relationships) == {"co": 1}
+
+    def test_cached_relationships(self, continent, country, continent_type):
+        assert TravelEntity.warm_relationships() == 2
+        entity = TravelEntity.objects.get(pk=continent.pk)
+        assert entity.cached_relationships == [("co", 1)]
+
+        other = TravelEntity.objects.create(
+            type=continent_type, code="OT", name="Other", full_name="Other"
+        )
+        country.continent = other
+        country.save()
+        assert TravelEntity.objects.get(pk=continent.pk).cached_relationships == []
+        assert TravelEntity.objects.get(pk=other.pk).cached_relationships == [("co", 1)]
+
+        country.delete()
+        assert TravelEntity.objects.get(pk=other.pk).cached_relationships == []
+
+
+@pytest.mark.django_db
+class TestRegistry:
+
+    def test_entity_types(
+        self,
+        country_type,
+        django_assert_num_queries,
+        django_capture_on_commit_callbacks,
+    ):
+        with django_assert_num_queries(1):
+            assert registry.entity_types.find("co") == country_type
+            assert registry.entity_types.get(country_type.pk) == country_type
+            assert registry.entity_types.pk_for("xx") is None
+
+        with django_capture_on_commit_callbacks(execute=True):
+            country_type.title = "Nation"
+            country_type.save()
+            assert registry.entity_types.find("co").title == "Nation"
+            version = registry.entity_types._snapshot[0]
+
+        # Bumped again on commit, past anything read before it
+        assert caching.get_version(registry.entity_types.version_name) != version
+
+    def test_without_cache(self, country_type, settings):
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+        }
+        assert registry.entity_types.find("co") == country_type
+        assert registry.entity_types.pk_for("co") == country_type.pk
+
+        country_type.title = "Nation"
+        country_type.save()
+        assert registry.entity_types.find("co").title == "Nation"
+
+
+@pytest.mark.django_db
+class TestTimezones:
+
+    def test_effective_timezone(self, country, django_assert_num_queries):
+        state_type = TravelEntityType.objects.create(abbr="st", title="State")
+        city_type = TravelEntityType.objects.create(abbr="ct", title="City")
+        state = TravelEntity.objects.create(
+            type=state_type, code="ST", name="State", full_name="State", country=country
+        )
+        city = TravelEntity.objects.create(
+            type=city_type,
+            code="CT",
+            name="City",
+            full_name="City",
+            state=state,
+            country=country,
+        )
+        assert city.effective_tz == "UTC"
+
+        country.tz = "Europe/Paris"
+        country.save()
+        city = TravelEntity.objects.get(pk=city.pk)
+        with django_assert_num_queries(0):
+            assert city.tzinfo is utils.get_tzinfo("Europe/Paris")
+
+        state.tz = "Asia/Tokyo"
+        state.save()
+        assert TravelEntity.objects.get(pk=city.pk).timezone == "Asia/Tokyo"
+
+        state.delete()
+        assert TravelEntity.objects.get(pk=city.pk).timezone == "Europe/Paris"
+
+        TravelEntity.objects.update(effective_tz="")
+        assert TravelEntity.objects.refresh_timezones() == 3
+        assert TravelEntity.objects.get(pk=city.pk).timezone == "Europe/Paris"
+
+        # A city linked only through its state still follows the country
+        state = TravelEntity.objects.create(
+            type=state_type, code="S2", name="S2", full_name="S2", country=country
+        )
+        city = TravelEntity.objects.create(
+            type=city_type, code="C2", name="C2", full_name="C2", state=state
+        )
+        country.tz = "Europe/Rome"
+        country.save()
+        assert TravelEntity.objects.get(pk=city.pk).timezone == "Europe/Rome"
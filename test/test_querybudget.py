@@ -0,0 +1,115 @@
+import logging
+
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.urls import reverse
+from travel import models as travel
+from travel import querybudget
+from travel import views
+
+
+@pytest.fixture
+def logged(user, country, continent, country_type):
+    travel.TravelProfile.objects.filter(user=user).update(access="PUB")
+    for i in range(3):
+        entity = travel.TravelEntity.objects.create(
+            type=country_type, code=f"C{i}", name=f"Country {i}", continent=continent
+        )
+        travel.TravelLog.objects.create(user=user, entity=entity)
+
+    return travel.TravelLog.objects.create(user=user, entity=country)
+
+
+@pytest.mark.django_db
+class TestQueryBudget:
+
+    def test_recorder(self, user):
+        with querybudget.record_queries() as recorder:
+            for _ in range(3):
+                travel.TravelProfile.objects.filter(user=user).first()
+            travel.TravelLog.objects.exists()
+
+        assert len(recorder) == 4
+        (site, statements), _ = recorder.by_site()
+        assert site.startswith("test_querybudget:") and len(statements) == 3
+        assert recorder.report().startswith("   3x test_querybudget:")
+
+        with pytest.raises(AssertionError, match="4 queries, over the budget of 3"):
+            with querybudget.assert_max_queries(3):
+                for _ in range(4):
+                    travel.TravelLog.objects.exists()
+
+    def test_template_call_site(self, client, user, logged):
+        with querybudget.record_queries() as recorder:
+            client.get(reverse("travel:profiles"))
+
+        assert any(site.startswith("travel/") for site, _ in recorder.by_site())
+
+    def test_view_budgets(self, client, user, user2, logged, country, bucketlist):
+        username = user.username
+        urls = [
+            reverse("travel:search") + "?search=country",
+            reverse("travel:by-locale", args=["co"]),
+            reverse("travel:entity", args=["co", country.code]),
+            reverse("travel:entity-relationships", args=["cn", "CN", "co"]),
+            reverse("travel:profiles"),
+            reverse("travel:profile", args=[username]),
+            reverse("travel:calendar", args=[username]),
+            reverse("travel:calendar", args=[username]) + "?view=year",
+            reverse("travel:profile-history", args=[username]),
+            reverse("travel:buckets"),
+            reverse("travel:bucket", args=[bucketlist.id, username]),
+            reverse(
+                "travel:bucket-comparison",
+                args=[bucketlist.id, f"{username}/{user2.username}"],
+            ),
+            reverse("travel:languages"),
+            reverse("travel:flag-quiz"),
+            reverse("travel:flag_game_api"),
+        ]
+        for url in urls:
+            assert querybudget.assert_view_budget(client, url).status_code == 200
+
+        client.force_login(user)
+        for url in urls + [
+            reverse("travel:search-advanced") + "?search=CO%0ACN",
+            reverse("travel:log-entry", args=[username, logged.pk]),
+            reverse("travel:user_log_api", args=[username]),
+        ]:
+            assert querybudget.assert_view_budget(client, url).status_code == 200
+
+    def test_middleware(self, client, user, logged, settings, caplog, monkeypatch):
+        settings.MIDDLEWARE = [
+            *settings.MIDDLEWARE,
+            "travel.querybudget.QueryBudgetMiddleware",
+        ]
+        url = reverse("travel:profiles")
+        with caplog.at_level(logging.WARNING, logger="travel.querybudget"):
+            client.get(url)
+            assert not caplog.records
+
+            monkeypatch.setattr(views.AllProfilesView, "query_budget", 0)
+            client.get(url)
+
+        (record,) = caplog.records
+        assert record.getMessage().startswith(f"GET {url} ran ")
+        assert "over its budget of 0" in record.getMessage()
+
+    def test_async_middleware(
+        self, async_client, user, logged, settings, caplog, monkeypatch
+    ):
+        settings.MIDDLEWARE = [
+            *settings.MIDDLEWARE,
+            "travel.querybudget.QueryBudgetMiddleware",
+        ]
+        # Async all the way down, without an adapter around the middleware
+        middleware = querybudget.QueryBudgetMiddleware(views.ProfileView.as_view())
+        assert iscoroutinefunction(middleware)
+
+        url = reverse("travel:profile", args=[user.username])
+        monkeypatch.setattr(views.ProfileView, "query_budget", 0)
+        with caplog.at_level(logging.WARNING, logger="travel.querybudget"):
+            assert async_to_sync(async_client.get)(url).status_code == 200
+
+        (record,) = caplog.records
+        assert "over its budget of 0" in record.getMessage()
@@ -1,9 +1,27 @@
+import io
+import random
+import re
+import threading
 import datetime
 from decimal import Decimal
 
 import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
 
-from travel import utils
+from travel import forms, manifest, sprites, utils
+from travel.extras import games
+from travel.models import (
+    TravelAlias,
+    TravelBucketList,
+    TravelEntity,
+    TravelEntityType,
+    TravelFlag,
+    TravelLog,
+    TravelProfile,
+)
+from travel.templatetags import travel_tags
 
 
 class TestJSONEncoding:
@@ -21,6 +39,41 @@ class TestJSONEncoding:
         result = utils.json_loads(out)
         assert data == result
 
+    def test_compact(self):
+        data = dict(
+            logs=[
+                dict(
+                    arrival=datetime.datetime(2009, 2, 9, 8, 15, tzinfo=datetime.UTC),
+                    value=Decimal("19.65"),
+                ),
+                dict(arrival=None, value=Decimal("1")),
+            ],
+            days=[datetime.date(2011, 4, 22), datetime.date(2011, 4, 23)],
+            a_time=datetime.time(16, 59, 59),
+            a_naive=datetime.datetime(2009, 2, 9, 8, 15, 30, 250000),
+            an_int=77,
+        )
+        out = utils.json_dumps(data, compact=True)
+        assert '"arrival":1234167300000' in out
+        assert utils.json_loads(out, compact=True) == data
+
+        with pytest.raises(TypeError):
+            utils.json_dumps([{"a": Decimal("1")}, {"a": "1"}], compact=True)
+
+    def test_iter_json(self):
+        data = dict(
+            rows=(dict(id=i, when=datetime.date(2011, 4, i + 1)) for i in range(3)),
+            a_decimal=Decimal("19.65"),
+            nested=[{"a": iter([1, 2])}],
+        )
+        chunks = list(utils.iter_json(data, buffer_size=8))
+        assert len(chunks) > 1
+        assert utils.json_loads("".join(chunks)) == dict(
+            rows=[dict(id=i, when=datetime.date(2011, 4, i + 1)) for i in range(3)],
+            a_decimal=Decimal("19.65"),
+            nested=[{"a": [1, 2]}],
+        )
+
 
 class TestLatLonParsing:
 
@@ -69,3 +122,253 @@ class TestNiceFormats:
             )
             == "pyrénées.svg"
         )
+
+    def test_search_tokens(self):
+        assert utils.normalize_search_text("  Côte d’Ivoire ") == "cote d ivoire"
+        assert utils.search_tokens("São Tomé-Príncipe") == [
+            "sao tome principe",
+            "tome principe",
+            "principe",
+        ]
+        assert utils.search_tokens("...") == []
+
+
+class TestTimezoneChoices:
+
+    def test_static_file(self, settings, tmp_path):
+        path = tmp_path / "tz.json"
+        settings.TRAVEL_TZ_CHOICES_FILE = str(path)
+        call_command("build_tz_choices", stdout=io.StringIO())
+        forms.tz_choices.cache_clear()
+        try:
+            assert forms.tz_choices() == forms.build_tz_choices()
+            assert ("UTC", "UTC") in forms.TZ_CHOICES
+        finally:
+            forms.tz_choices.cache_clear()
+
+
+@pytest.mark.django_db
+class TestMediaManifest:
+
+    def test_manifest(
+        self, settings, tmp_path, monkeypatch, django_capture_on_commit_callbacks
+    ):
+        monkeypatch.setattr(manifest, "CHECK_INTERVAL", 0)
+        settings.MEDIA_ROOT = str(tmp_path)
+        (tmp_path / "travel/img/flags").mkdir(parents=True)
+        (tmp_path / "travel/img/flags/1-us.svg").write_text("<svg/>")
+        flag = TravelFlag(source="http://example.com/us.svg")
+        flag.svg = "travel/img/flags/1-us.svg"
+
+        # No manifest yet: check the filesystem
+        assert manifest.media_manifest.names() is None
+        assert flag.image_url == "/travel/img/flags/1-us.svg"
+
+        call_command("build_media_manifest", stdout=io.StringIO())
+        assert manifest.media_manifest.names() == {"travel/img/flags/1-us.svg"}
+
+        (tmp_path / "travel/img/flags/2-fr.svg").write_text("<svg/>")
+        flag = TravelFlag.objects.create(source="http://example.com/fr.svg")
+        assert flag.image_url == "http://example.com/fr.svg"
+
+        flag.svg = "travel/img/flags/2-fr.svg"
+        flag.save()
+        del flag.image_url
+        assert flag.image_url == "/travel/img/flags/2-fr.svg"
+        assert manifest.media_manifest.exists("travel/img/flags/1-us.svg")
+        assert not manifest.media_manifest.exists("travel/img/map/us.gif")
+
+        # Only files that exist are added
+        flag.svg = "travel/img/flags/3-de.svg"
+        flag.save()
+        assert not manifest.media_manifest.exists("travel/img/flags/3-de.svg")
+        del flag.image_url
+        assert flag.image_url == "http://example.com/fr.svg"
+
+        # Deleting a flag leaves its file in place
+        flag.svg = "travel/img/flags/2-fr.svg"
+        with django_capture_on_commit_callbacks(execute=True):
+            flag.delete()
+        assert (tmp_path / "travel/img/flags/2-fr.svg").exists()
+        assert manifest.media_manifest.names() == {"travel/img/flags/1-us.svg"}
+
+    def test_concurrent_updates(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        manifest.media_manifest.rebuild()
+        names = [f"travel/img/flags/{i}.svg" for i in range(20)]
+        threads = [
+            threading.Thread(target=manifest.media_manifest.add, args=[name])
+            for name in names
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert manifest.media_manifest._read() == set(names)
+        assert not list(tmp_path.glob("travel/*.tmp"))
+
+    def test_without_cache(self, settings, tmp_path, monkeypatch):
+        monkeypatch.setattr(manifest, "CHECK_INTERVAL", 0)
+        settings.MEDIA_ROOT = str(tmp_path)
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+        }
+        manifest.media_manifest.rebuild()
+        assert manifest.media_manifest.names() == set()
+        assert not manifest.media_manifest.exists("travel/img/flags/us.svg")
+
+        manifest.media_manifest.add("travel/img/flags/us.svg")
+        assert manifest.media_manifest.exists("travel/img/flags/us.svg")
+
+
+@pytest.mark.django_db
+class TestGenerateLoadData:
+
+    def generate(self, *args):
+        options = ["--users=3", "--logs=4", "--bucketlists=1", "--aliases=1"]
+        call_command("generate_load_data", *options, *args, stdout=io.StringIO())
+        return sorted(
+            TravelLog.objects.filter(user__username__startswith="load-").values_list(
+                "user__username", "entity_id", "arrival", "rating"
+            )
+        )
+
+    def test_generate(self, country):
+        state_type = TravelEntityType.objects.create(abbr="st", title="State")
+        TravelEntity.objects.create(
+            type=state_type, code="ST", name="Stàte", country=country
+        )
+        logs = self.generate()
+        users = User.objects.filter(username__startswith="load-")
+        assert users.count() == 3
+        assert TravelProfile.objects.filter(user__in=users).count() == 3
+        assert len(logs) >= 3
+        assert TravelBucketList.objects.filter(owner__in=users).exists()
+        aliases = TravelAlias.objects.filter(category__title="Generated")
+        count = aliases.count()
+        assert count
+
+        with pytest.raises(CommandError, match="already exists"):
+            self.generate()
+
+        # Replacing the data with the same seed gives the same rows
+        assert self.generate("--clear") == logs
+        assert users.count() == 3
+        assert aliases.count() == count
+
+
+@pytest.mark.django_db
+class TestFlagSprite:
+
+    def test_sprite(self, client, settings, tmp_path, monkeypatch):
+        monkeypatch.setattr(manifest, "CHECK_INTERVAL", 0)
+        settings.MEDIA_ROOT = str(tmp_path)
+        (tmp_path / "travel/img/flags").mkdir(parents=True)
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg" width="30" height="20">'
+            '<defs><linearGradient id="g"/></defs>'
+            '<rect fill="url(#g)" width="30" height="20"/></svg>'
+        )
+        flags = []
+        for code in ["us", "fr"]:
+            name = f"travel/img/flags/{code}.svg"
+            (tmp_path / name).write_text(svg)
+            flags.append(TravelFlag.objects.create(source=code, svg=name))
+
+        (tmp_path / "travel/img/flags/bad.svg").write_text("<svg")
+        bad = TravelFlag.objects.create(source="bad", svg="travel/img/flags/bad.svg")
+
+        # No sprite yet
+        us, fr = flags
+        assert travel_tags.flag_icon(us).startswith('<img class="flag flag-sm"')
+
+        out = io.StringIO()
+        call_command("build_flag_sprite", stdout=out, stderr=io.StringIO())
+        assert out.getvalue().startswith("Wrote 2 flags")
+
+        text = (tmp_path / sprites.SPRITE_NAME).read_text()
+        assert f'<symbol id="flag-{us.pk}" viewBox="0 0 30 20">' in text
+        assert f'id="flag-{fr.pk}-g"' in text
+        assert f'fill="url(#flag-{fr.pk}-g)"' in text
+
+        icon = travel_tags.flag_icon(fr, "flag-md")
+        assert icon.startswith('<svg class="flag flag-md" viewBox="0 0 30 20"')
+        assert f'#flag-{fr.pk}"></use>' in icon
+        assert travel_tags.flag_icon(bad).startswith("<img")
+        symbols = travel_tags.flag_sprite_data()["symbols"]
+        assert symbols[us.svg.url] == [f"flag-{us.pk}", "0 0 30 20"]
+
+        # Served from the site's origin, which <use> requires
+        href = re.search(r'href="([^"#]+)', icon)[1]
+        assert href.startswith("/flags/sprite.svg?v=")
+        r = client.get(href)
+        assert b"".join(r.streaming_content).decode() == text
+        assert "immutable" in r["Cache-Control"]
+        assert client.get(href, HTTP_IF_NONE_MATCH=r["ETag"]).status_code == 304
+
+        # The sprite no longer holds a flag whose SVG has changed
+        fr.svg = "travel/img/flags/fr-2.svg"
+        assert travel_tags.flag_icon(fr).startswith("<img")
+
+        # Nor one whose file was replaced under the same name
+        (tmp_path / us.svg.name).write_text(svg.replace("30", "40"))
+        assert travel_tags.flag_icon(us).startswith("<svg")
+        us.save()
+        assert travel_tags.flag_icon(us).startswith("<img")
+
+        settings.TRAVEL_FLAG_SPRITE = False
+        fr = TravelFlag.objects.get(pk=fr.pk)
+        assert travel_tags.flag_icon(fr).startswith("<img")
+
+
+class TestFlagRounds:
+
+    def test_similarity(self):
+        svg = '<svg><rect fill="#CE1126"/><path style="fill:#fff"/><g fill="navy"/>'
+        assert games.flag_colours(svg) == {"red", "white", "blue"}
+
+        index = games.similarity_index(
+            [
+                ("AT", "Europe", "Western Europe", {"red", "white"}),
+                ("LV", "Europe", "Northern Europe", {"maroon", "white"}),
+                ("CH", "Europe", "Western Europe", {"red", "white"}),
+                ("JP", "Asia", "Eastern Asia", {"red", "white"}),
+                ("BR", "Americas", "South America", {"green", "yellow"}),
+            ]
+        )
+        # FLAG_GROUPS, then subregion and colours, then colours alone
+        assert index["AT"] == ["LV", "CH", "JP"]
+        assert index["BR"] == []
+
+        countries = {code: [code, f"/{code}.svg"] for code in index}
+        game_round = games.make_round(
+            {"countries": countries, "similar": index}, random.Random(1)
+        )
+        codes = [flag["code"] for flag in game_round["flags"]]
+        assert len(set(codes)) == games.CHOICES
+        assert game_round["code"] in codes
+        # Every similar flag is used before random ones
+        assert set(index[game_round["code"]]) <= set(codes)
+
+    def test_colours_cached(self, settings, tmp_path, monkeypatch):
+        settings.MEDIA_ROOT = str(tmp_path)
+        (tmp_path / "at.svg").write_text('<svg><rect fill="#CE1126"/>')
+        reads = []
+        read_colours = games._read_colours
+
+        def counted(name):
+            reads.append(name)
+            return read_colours(name)
+
+        monkeypatch.setattr(games, "_read_colours", counted)
+
+        names = ["at.svg", "missing.svg"]
+        assert games.read_colours(names) == {"at.svg": {"red"}, "missing.svg": set()}
+        assert games.read_colours(names)["at.svg"] == {"red"}
+        assert reads == ["at.svg"]
+
+        # A file replaced with a different size is read again
+        (tmp_path / "at.svg").write_text('<svg><rect fill="#fff"/><g fill="navy"/>')
+        assert games.read_colours(names)["at.svg"] == {"white", "blue"}
+        assert reads == ["at.svg", "at.svg"]
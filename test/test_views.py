@@ -1,6 +1,16 @@
+import json
+from datetime import date
+
 import pytest
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import RequestFactory
 from django.urls import reverse
+from django.utils.functional import empty
+from travel import caching
 from travel import models as travel
+from travel import utils
 
 
 @pytest.mark.django_db
@@ -130,7 +140,274 @@ class TestViews:
         r = client.get(reverse("travel:language", args=[0]))
         assert r.status_code == 404
 
-    def test_calendar(self, client, user):
+    def test_calendar(self, client, user, country, django_assert_num_queries):
         travel.TravelProfile.objects.filter(user=user).update(access="PUB")
         r = client.get(reverse("travel:calendar", args=[user.username]))
         assert r.status_code == 200
+
+        for when in ["2020-01-31", "2020-02-29", "2020-03-01", "2019-02-10"]:
+            travel.TravelLog.objects.create(
+                user=user, entity=country, arrival=f"{when}T12:00:00Z"
+            )
+
+        # The February 2020 grid runs from Sunday Jan 26 to Saturday Feb 29
+        url = reverse("travel:calendar", args=[user.username])
+        r = client.get(url + "?when=2020-2")
+        days = {day: items for week in r.context["dates"] for day, items in week}
+        assert len(days) == 35
+        assert [day.day for day, items in days.items() if items] == [31, 29]
+
+        r = client.get(url + "?view=year&when=2020")
+        assert len(r.context["calendars"]) == 12
+        months = [month.month for month, _ in r.context["calendars"]]
+        assert months == list(range(1, 13))
+        february = [items for week in r.context["calendars"][1][1] for _, items in week]
+        assert sum(map(len, february)) == 2
+
+        with django_assert_num_queries(2):
+            # The profile and one range query for the logs
+            client.get(url + "?view=year&when=2019")
+
+        # Years at the edges of the date range are clamped
+        for query in ["when=9999-12", "when=1-1", "view=year&when=9999"]:
+            assert client.get(f"{url}?{query}").status_code == 200
+        r = client.get(url + "?when=9999-12")
+        assert r.context["when"] == date(9998, 12, 1)
+
+    def test_context_processor(self, client, user, settings):
+        client.force_login(user)
+        r = client.get(reverse("travel:profiles"))
+        assert {"site", "search_form", "checklist"} <= r.context.keys()
+        # profiles listing never renders _visited.html
+        assert r.context["checklist"]._wrapped is empty
+
+        settings.TRAVEL_CONTEXT_PROCESSOR = {"site": False, "checklist": False}
+        r = client.get(reverse("travel:profiles"))
+        assert "search_form" in r.context
+        assert "site" not in r.context
+        assert "checklist" not in r.context
+
+    def test_keyset_pagination(self, country_type, continent):
+        for code in ["C", "A", "B", "B"]:
+            travel.TravelEntity.objects.create(
+                type=country_type, code=code, name=code, full_name=code
+            )
+
+        template = Template(
+            "{% load pagination_tags %}{% keysetpaginate entities 2 %}"
+            "{% for e in entities %}{{ e.name }}{% endfor %}|"
+            "{{ page_obj.previous_cursor|default:'' }}|"
+            "{{ page_obj.next_cursor|default:'' }}"
+        )
+
+        def render(query=""):
+            request = RequestFactory().get("/" + query)
+            qs = travel.TravelEntity.objects.type_related(country_type)
+            return template.render(Context({"request": request, "entities": qs}))
+
+        names, prev, next = render().split("|")
+        assert (names, prev) == ("AB", "")
+        names, prev, next = render(f"?after={next}").split("|")
+        assert names == "BC"
+        assert next == ""
+        names, prev, next = render(f"?before={prev}").split("|")
+        assert (names, prev) == ("AB", "")
+        assert render("?after=garbage").split("|")[0] == "AB"
+
+    def test_type_count(self, country, country_type, django_assert_num_queries):
+        assert travel.TravelEntity.objects.type_count(country_type) == 1
+        with django_assert_num_queries(0):
+            assert travel.TravelEntity.objects.type_count(country_type) == 1
+
+        travel.TravelEntity.objects.create(
+            type=country_type, code="XX", name="X", full_name="X"
+        )
+        assert travel.TravelEntity.objects.type_count(country_type) == 2
+
+    def test_user_log_api(self, client, user, country, continent):
+        url = reverse("travel:user_log_api", args=[user.username])
+        r = client.get(url)
+        assert r.status_code == 200
+        assert r.json() == {"username": user.username, "logs": [], "entities": []}
+
+        log = travel.TravelLog.objects.create(user=user, entity=country)
+        travel.TravelLog.objects.create(user=user, entity=continent)
+        r = client.get(url)
+        etag = r["ETag"]
+        data = r.json()
+        assert {e["code"] for e in data["entities"]} == {"CO", "CN"}
+        assert len(data["logs"]) == 2
+
+        # patched in place, identical to a full rebuild
+        history = travel.TravelLogHistory.objects.get(user=user)
+        rebuilt = travel.TravelLogHistory.objects.rebuild(user)
+        assert (history.data, history.etag) == (rebuilt.data, rebuilt.etag)
+
+        r = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == 304
+
+        log.delete()
+        r = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == 200
+        assert [e["code"] for e in r.json()["entities"]] == ["CN"]
+
+    def test_user_log_api_invalidation(self, client, user, country, continent):
+        state_type = travel.TravelEntityType.objects.create(abbr="st", title="State")
+        state = travel.TravelEntity.objects.create(
+            type=state_type, code="ST", name="State", country=country
+        )
+        flag = travel.TravelFlag.objects.create(source="co", svg="img/co.svg")
+        continent.flag = flag
+        continent.save()
+        arrival = travel.TravelLog.objects.create(user=user, entity=state).arrival
+        # Tied arrivals keep the order of a full rebuild
+        travel.TravelLog.objects.create(user=user, entity=continent, arrival=arrival)
+        travel.TravelLog.objects.create(user=user, entity=country, arrival=arrival)
+        url = reverse("travel:user_log_api", args=[user.username])
+        client.get(url)
+        history = travel.TravelLogHistory.objects.get(user=user)
+        travel.TravelLog.objects.create(user=user, entity=state, arrival=arrival)
+        history = travel.TravelLogHistory.objects.get(user=user)
+        rebuilt = travel.TravelLogHistory.objects.rebuild(user)
+        assert (history.data, history.etag) == (rebuilt.data, rebuilt.etag)
+
+        # Renaming a country changes the payload of its states' logs
+        country.name = "Renamed"
+        country.save()
+        entities = {e["code"]: e for e in client.get(url).json()["entities"]}
+        assert entities["ST"]["country_name"] == "Renamed"
+
+        flag.svg = "img/co-2.svg"
+        flag.save()
+        entities = {e["code"]: e for e in client.get(url).json()["entities"]}
+        assert entities["CN"]["flag_svg"].endswith("/img/co-2.svg")
+
+    def test_flag_game_api(self, client, country, country_type, continent):
+        flag = travel.TravelFlag.objects.create(source="at", svg="img/at.svg")
+        travel.TravelEntity.objects.create(
+            type=country_type, code="AT", name="Austria", flag=flag
+        )
+        url = reverse("travel:flag_game_api")
+        r = client.get(url)
+        assert r.status_code == 200
+        assert "public" in r["Cache-Control"]
+        etag = r["ETag"]
+        # Countries without a flag are left out
+        assert [c["code"] for c in r.json()["countries"]] == ["AT"]
+        assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        flag.svg = "img/at-2.svg"
+        flag.save()
+        r = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == 200
+        assert r["ETag"] != etag
+        assert r.json()["countries"][0]["image"].endswith("/img/at-2.svg")
+
+    def test_flag_round_api(self, client, country_type):
+        url = reverse("travel:flag_game_round_api")
+        assert client.get(url).status_code == 404
+
+        for code in ["AT", "LV", "PE", "PF"]:
+            flag = travel.TravelFlag.objects.create(source=code, svg=f"{code}.svg")
+            travel.TravelEntity.objects.create(
+                type=country_type, code=code, name=code, flag=flag
+            )
+
+        r = client.get(url)
+        assert r.status_code == 200
+        assert "no-cache" in r["Cache-Control"]
+        data = r.json()
+        assert data["name"] == data["code"]
+        assert sorted(flag["code"] for flag in data["flags"]) == ["AT", "LV", "PE", "PF"]
+
+    def test_flag_game_invalidation(self, country, continent):
+        def version():
+            return caching.get_version("flag-game")
+
+        start = version()
+        continent.name = "Renamed"
+        continent.save()
+        country.save()
+        travel.TravelEntityInfo.objects.create(entity=continent, region="Europe")
+        assert version() == start
+
+        info = travel.TravelEntityInfo.objects.create(entity=country, region="Europe")
+        assert version() > start
+        start = version()
+        info.population = 10
+        info.save()
+        assert version() == start
+
+        country.name = "Renamed"
+        country.save()
+        assert version() > start
+
+    def test_async_views(self, async_client, user, country):
+        # Through the ASGI handler, where sync-only database access would fail
+        travel.TravelLog.objects.create(user=user, entity=country)
+        travel.TravelProfile.objects.filter(user=user).update(access="PUB")
+        async_client.force_login(user)
+        urls = [
+            reverse("travel:entity", args=["co", country.code]),
+            reverse("travel:by-locale", args=["co"]),
+            reverse("travel:search") + "?search=country&type=co",
+            reverse("travel:profile", args=[user.username]),
+            reverse("travel:user_log_api", args=[user.username]),
+        ]
+        for url in urls:
+            r = async_to_sync(async_client.get)(url)
+            assert r.status_code == 200, url
+
+        r = async_to_sync(async_client.get)(urls[0])
+        assert r.context["history"][0].entity == country
+        r = async_to_sync(async_client.get)(reverse("travel:entity", args=["co", "XX"]))
+        assert r.status_code == 404
+
+    def test_profile_history(self, client, user, user2, country):
+        travel.TravelLog.objects.create(user=user, entity=country)
+        url = reverse("travel:profile-history", args=[user.username])
+        client.force_login(user2)
+        assert client.get(url).status_code == 404
+
+        client.force_login(user)
+        r = client.get(url)
+        assert r.streaming
+        data = json.loads(b"".join(r.streaming_content))
+        assert [e["code"] for e in data["entities"]] == ["CO"]
+        assert len(data["logs"]) == 1
+
+        r = client.get(url, {"format": "compact"})
+        data = utils.json_loads(r.content, compact=True)
+        arrival = travel.TravelLog.objects.get().arrival
+        assert data["logs"][0]["arrival"] == arrival.replace(
+            microsecond=arrival.microsecond // 1000 * 1000
+        )
+
+    def test_profile_history_asgi(self, async_client, user, country):
+        travel.TravelLog.objects.create(user=user, entity=country)
+        url = reverse("travel:profile-history", args=[user.username])
+        async_client.force_login(user)
+        r = async_to_sync(async_client.get)(url)
+        assert r.is_async
+
+        async def read():
+            return b"".join([piece async for piece in r.streaming_content])
+
+        data = json.loads(async_to_sync(read)())
+        assert [e["code"] for e in data["entities"]] == ["CO"]
+        assert len(data["logs"]) == 1
+
+    def test_user_log_import(self, client, user, user2, country):
+        url = reverse("travel:user_log_import_api", args=[user.username])
+        upload = SimpleUploadedFile("logs.csv", b"type,code,arrival\nco,CO,2020-01-02\n")
+        r = client.post(url, {"file": upload})
+        assert r.status_code == 403
+
+        client.force_login(user2)
+        assert client.post(url, {"file": upload}).status_code == 403
+
+        client.force_login(user)
+        upload.seek(0)
+        r = client.post(url, {"file": upload})
+        assert r.status_code == 200
+        assert r.json() == {"created": 1, "errors": []}